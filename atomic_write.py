@@ -0,0 +1,20 @@
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+  """Opens a temp file next to path to write instead, and moves it over path
+  once the with block is done. Readers, and runs that are interrupted, see
+  either the old file or the whole new one, never a truncated file."""
+  # One temp file per process, so processes writing the same file (e.g. the
+  # same cache entry) don't write into each other's.
+  temp_path = '{}.tmp{}'.format(path, os.getpid())
+  try:
+    with open(temp_path, mode) as f:
+      yield f
+    os.replace(temp_path, path)
+  except BaseException:
+    if os.path.exists(temp_path):
+      os.remove(temp_path)
+    raise
@@ -0,0 +1,242 @@
+"""Measures parsing and loading throughput on synthetic data.
+
+Generates data with synthetic_data.py (or uses --data_path), times each
+stage of the pipeline, and saves the results as JSON. Pass the results of an
+earlier run with --compare to see what changed, e.g.
+
+  python benchmark.py --results_path=before.json
+  (change some code)
+  python benchmark.py --results_path=after.json --compare=before.json
+"""
+from event import Event
+from event_reader import EventReader
+from game import Game
+from play import Play
+from rosters import Rosters
+from scheduler import GameScheduler
+from stats_tracker import StatsTracker
+import synthetic_data
+
+import argparse
+from collections import defaultdict
+from collections import OrderedDict
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+_REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def best_time(fn, repeat):
+  """Runs fn repeat times and returns the fastest run in seconds. Anything fn
+  prints is thrown away."""
+  times = []
+  for _ in range(repeat):
+    with contextlib.redirect_stdout(io.StringIO()):
+      start = time.perf_counter()
+      fn()
+      times.append(time.perf_counter() - start)
+  return min(times)
+
+
+def result(seconds, count, unit):
+  return OrderedDict([
+    ('seconds', seconds),
+    ('count', count),
+    ('unit', unit),
+    ('per_second', count / seconds if seconds else None),
+  ])
+
+
+def season_dirs(data_path):
+  return sorted(f.path for f in os.scandir(data_path) if f.is_dir())
+
+
+def event_lines(data_path):
+  lines = []
+  for season_dir in season_dirs(data_path):
+    for filename in sorted(glob.glob(os.path.join(season_dir, '*.EV*'))):
+      with open(filename, 'r') as f:
+        lines.extend(line.rstrip() for line in f)
+  return lines
+
+
+def bench_tokenize(lines, repeat):
+  def run():
+    for line in lines:
+      Event.from_line(line)
+  return result(best_time(run, repeat), len(lines), 'lines')
+
+
+def bench_decode(lines, repeat):
+  play_events = [Event.from_line(line) for line in lines if line.startswith(Event.Types.play + ',')]
+  def run():
+    for play_event in play_events:
+      Play.from_event(play_event)
+  return result(best_time(run, repeat), len(play_events), 'plays')
+
+
+def bench_gobble(data_path, repeat):
+  # Every season's games, in order, as parse.py would. Reading the files is
+  # left out.
+  season_paths = season_dirs(data_path)
+  rosters = Rosters.from_files([filename for season_path in season_paths for filename in glob.glob(os.path.join(season_path, '*.ROS*'))])
+  seasons = []
+  for season_path in season_paths:
+    season_files = OrderedDict()
+    for filename in sorted(glob.glob(os.path.join(season_path, '*.EV*'))):
+      with open(filename, 'rb') as f:
+        season_files[filename] = f.read()
+    seasons.append(season_files)
+  num_games = [0]
+  def run():
+    # Start cold, without plays decoded by an earlier run.
+    StatsTracker.play_cache.clear()
+    stats = StatsTracker()
+    last_game_rosters = defaultdict(dict)
+    num_games[0] = 0
+    for season_files in seasons:
+      readers = [EventReader(data, name=filename) for filename, data in season_files.items()]
+      for reader in GameScheduler(readers):
+        game = Game(float_precision=False)
+        game.gobble(reader, stats, roster_styles=['participants'], full_rosters=rosters, last_game_rosters=last_game_rosters)
+        _, visitor_team, visitor_ids, home_team, home_ids = game.participant_ids()
+        last_game_rosters[visitor_team] = visitor_ids
+        last_game_rosters[home_team] = home_ids
+        num_games[0] += 1
+  return result(best_time(run, repeat), num_games[0], 'games')
+
+
+def bench_parse(data_path, work_path, num_games, repeat):
+  # The whole of parse.py, from event files to a sample store, without the
+  # decode cache.
+  prefix = os.path.join(work_path, 'samples')
+  command = [sys.executable, 'parse.py', '--f', '--data_path=' + data_path, '--parsed_data_prefix=' + prefix, '--decode_cache_dir=']
+  def run():
+    subprocess.run(command, cwd=_REPO_PATH, check=True, stdout=subprocess.DEVNULL)
+  return result(best_time(run, repeat), num_games, 'games'), prefix
+
+
+def bench_load(prefix, repeat):
+  # LoadData needs Keras to be installed.
+  from training_helpers import LoadData
+  num_samples = [0]
+  def run():
+    x_train, x_validate, x_test, _, _, _ = LoadData(prefix, validate_fraction=0.1, test_fraction=0.1)
+    num_samples[0] = len(x_train) + len(x_validate) + len(x_test)
+  return result(best_time(run, repeat), num_samples[0], 'samples')
+
+
+def git_commit():
+  try:
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=_REPO_PATH, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def compare(results, old_results):
+  print('')
+  print('{:<10} {:>14} {:>14} {:>8}'.format('benchmark', 'before /s', 'after /s', 'speedup'))
+  for name, new in results['benchmarks'].items():
+    old = old_results['benchmarks'].get(name)
+    if not old or not old.get('per_second') or not new.get('per_second'):
+      continue
+    print('{:<10} {:>14.1f} {:>14.1f} {:>7.2f}x'.format(name, old['per_second'], new['per_second'], new['per_second'] / old['per_second']))
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--data_path', action='store', default=None, dest='data_path',
+                      help='Data dir to benchmark on. By default, synthetic data is generated.')
+  parser.add_argument('--seasons', action='store', default=2, dest='seasons', type=int,
+                      help='Seasons of synthetic data')
+  parser.add_argument('--teams', action='store', default=16, dest='num_teams', type=int,
+                      help='Teams in the synthetic data')
+  parser.add_argument('--games', action='store', default=60, dest='games_per_team', type=int,
+                      help='Games per team per season of synthetic data')
+  parser.add_argument('--sub_rate', action='store', default=0.3, dest='sub_rate', type=float,
+                      help='Chance of a substitution after each half inning of synthetic data')
+  parser.add_argument('--advance_rate', action='store', default=0.2, dest='advance_rate', type=float,
+                      help='Fraction of synthetic plays with several runners advancing')
+  parser.add_argument('--seed', action='store', default=0, dest='seed', type=int,
+                      help='Random seed for the synthetic data')
+  parser.add_argument('--repeat', action='store', default=3, dest='repeat', type=int,
+                      help='Times to run each benchmark. The fastest run counts.')
+  parser.add_argument('--results_path', action='store', default='benchmark_results.json', dest='results_path',
+                      help='Where to save the results')
+  parser.add_argument('--compare', action='store', default=None, dest='compare',
+                      help='Results of an earlier run to compare with')
+  args = parser.parse_args()
+
+  work_path = tempfile.mkdtemp(prefix='machineball_benchmark_')
+  try:
+    data = OrderedDict()
+    data_path = args.data_path
+    if data_path is None:
+      data_path = os.path.join(work_path, 'data')
+      synthetic_data.generate(data_path, seasons=args.seasons, num_teams=args.num_teams, games_per_team=args.games_per_team,
+                              sub_rate=args.sub_rate, advance_rate=args.advance_rate, seed=args.seed)
+      data.update([('seasons', args.seasons), ('teams', args.num_teams), ('games_per_team', args.games_per_team),
+                   ('sub_rate', args.sub_rate), ('advance_rate', args.advance_rate), ('seed', args.seed)])
+    else:
+      data['data_path'] = os.path.abspath(data_path)
+    data_path = os.path.abspath(data_path)
+
+    benchmarks = OrderedDict()
+    lines = event_lines(data_path)
+    print('Tokenizing events')
+    benchmarks['tokenize'] = bench_tokenize(lines, args.repeat)
+    print('Decoding plays')
+    benchmarks['decode'] = bench_decode(lines, args.repeat)
+    print('Gobbling games')
+    benchmarks['gobble'] = bench_gobble(data_path, args.repeat)
+    print('Running parse.py')
+    benchmarks['parse'], prefix = bench_parse(data_path, work_path, benchmarks['gobble']['count'], args.repeat)
+    print('Loading and padding samples')
+    try:
+      benchmarks['load'] = bench_load(prefix, args.repeat)
+    except ImportError as e:
+      print('Skipping: {}'.format(e))
+      benchmarks['load'] = OrderedDict([('skipped', str(e))])
+  finally:
+    shutil.rmtree(work_path)
+
+  data['lines'] = len(lines)
+  results = OrderedDict([
+    ('git_commit', git_commit()),
+    ('time', time.strftime('%Y-%m-%d %H:%M:%S')),
+    ('python', platform.python_version()),
+    ('numpy', np.__version__),
+    ('data', data),
+    ('benchmarks', benchmarks),
+  ])
+  with open(args.results_path, 'w') as f:
+    json.dump(results, f, indent=2)
+
+  print('')
+  for name, benchmark in benchmarks.items():
+    if 'skipped' in benchmark:
+      print('{:<10} skipped'.format(name))
+    else:
+      print('{:<10} {:>12.1f} {}/s ({} {} in {:.3f}s)'.format(
+        name, benchmark['per_second'], benchmark['unit'], benchmark['count'], benchmark['unit'], benchmark['seconds']))
+  print('Results saved to {}'.format(args.results_path))
+
+  if args.compare:
+    with open(args.compare, 'r') as f:
+      compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,95 @@
+"""Finds and reads the seasons of Retrosheet data under a data dir.
+
+A season is either a directory of event and roster files, or a zip archive
+of them as downloaded from Retrosheet, e.g. data/2019eve.zip. Files inside
+archives are named by joining the archive's path and the member's name, like
+data/2019eve.zip/2019ANA.EVA, and are read straight from the archive
+without unzipping anything to disk."""
+from multiprocessing.pool import ThreadPool
+
+import fnmatch
+import glob
+import io
+import os
+import zipfile
+
+ARCHIVE_EXTENSION = '.zip'
+
+
+def season_paths(data_path):
+  """Season dirs and archives under data_path, in the order they are parsed."""
+  paths = [f.path for f in os.scandir(data_path)
+           if f.is_dir() or (f.is_file() and f.name.lower().endswith(ARCHIVE_EXTENSION))]
+  # Archives sort by name like dirs do, e.g. 2018eve.zip before 2019eve.zip.
+  paths.sort(key=season_name)
+  return paths
+
+
+def season_name(season_path):
+  """The name of a season, e.g. 2019ev for data/2019ev or 2019eve for
+  data/2019eve.zip. Checkpoints and reports refer to seasons by it."""
+  name = os.path.basename(season_path)
+  if is_archive(season_path):
+    name = name[:-len(ARCHIVE_EXTENSION)]
+  return name
+
+
+def is_archive(path):
+  return path.lower().endswith(ARCHIVE_EXTENSION) and os.path.isfile(path)
+
+
+def split_member(filename):
+  """(archive path, member name) of a file in an archive, or None if
+  filename is a plain file. Members can be in subdirs of the archive, like
+  data/2019eve.zip/2019eve/2019ANA.EVA."""
+  path = filename
+  member_parts = []
+  while True:
+    path, part = os.path.split(path)
+    if not part:
+      return None
+    member_parts.insert(0, part)
+    if is_archive(path):
+      # Archives always use / in member names.
+      return path, '/'.join(member_parts)
+
+
+def season_files(season_path, pattern):
+  """Files of a season matching a glob pattern like '*.EV*'. Archive members
+  come in sorted order."""
+  if not is_archive(season_path):
+    return sorted(glob.glob(os.path.join(season_path, pattern)))
+  with zipfile.ZipFile(season_path) as archive:
+    members = sorted(name for name in archive.namelist() if fnmatch.fnmatch(os.path.basename(name), pattern))
+  # Retrosheet archives are flat, but members may also be in subdirs (see
+  # split_member()). Skip the entries of the subdirs themselves.
+  return [os.path.join(season_path, member) for member in members if not member.endswith('/')]
+
+
+def read_bytes(filename):
+  """Everything in a plain file or an archive member."""
+  member = split_member(filename)
+  if member is None:
+    with open(filename, 'rb') as f:
+      return f.read()
+  archive_path, name = member
+  # Every call opens the archive itself, so calls can run in parallel
+  # threads.
+  with zipfile.ZipFile(archive_path) as archive:
+    return archive.read(name)
+
+
+def read_many(filenames, threads=4):
+  """read_bytes() of every file, in order. Archive members are decompressed
+  in several threads at once, which zlib allows since it releases the GIL."""
+  if threads <= 1 or len(filenames) <= 1:
+    return [read_bytes(filename) for filename in filenames]
+  with ThreadPool(min(threads, len(filenames))) as pool:
+    return pool.map(read_bytes, filenames)
+
+
+def open_text(filename):
+  """Opens a plain file or an archive member for reading text."""
+  if split_member(filename) is None:
+    return open(filename, 'r')
+  return io.TextIOWrapper(io.BytesIO(read_bytes(filename)))
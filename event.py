@@ -1,6 +1,8 @@
-import re
+import sys
 
 class Event(object):
+  __slots__ = ('type', 'parts', 'raw', 'tally')
+
   class Types(object):
     id = 'id'
     info = 'info'
@@ -8,20 +10,56 @@ class Event(object):
     sub = 'sub'
     play = 'play'
 
-  def __init__(self):
-    self.type = None
-    parts = []
-    self.raw = None
-    
+  # These are rare characters that just mark uncertain plays.
+  _UNCERTAINTY_MARKS = str.maketrans('', '', '#!?')
+
+  def __init__(self, type=None, parts=None, raw=None):
+    self.type = type
+    self.parts = parts if parts is not None else []
+    self.raw = raw
+    # What the play adds to player stats (a PlayTally, see stats_tracker.py),
+    # for play events that were decoded ahead of time.
+    self.tally = None
+
+  @staticmethod
+  def _split(line):
+    # Splits on commas, except for commas inside quotation marks (like in
+    # player names). Lines without quotes, which is nearly all of them, are a
+    # plain split.
+    if '"' not in line:
+      return line.split(',')
+    chunks = line.split('"')
+    if len(chunks) % 2 == 0:
+      # Unbalanced quotes. Don't guess.
+      return line.split(',')
+    parts = ['']
+    for i, chunk in enumerate(chunks):
+      if i % 2:
+        # inside quotes: the chunk belongs to the current part, quotes and all
+        parts[-1] += '"' + chunk + '"'
+      else:
+        fields = chunk.split(',')
+        parts[-1] += fields[0]
+        parts.extend(fields[1:])
+    return parts
+
   @classmethod
   def from_line(cls, line):
-    event = Event()
-    event.raw = line
-    # These are rare characters that just mark uncertain plays.
-    line = re.sub('[#!?]', '', line)
-    # TODO: improve this. For example, handle comma inside quotation marks correctly.
-    event.parts = line.split(',')
-    event.type = event.parts[0]
-    return event
-    
-   
\ No newline at end of file
+    cleaned_line = line
+    if '#' in line or '!' in line or '?' in line:
+      cleaned_line = line.translate(cls._UNCERTAINTY_MARKS)
+    parts = cls._split(cleaned_line)
+    return cls(sys.intern(parts[0]), parts, line)
+
+  @classmethod
+  def from_lines(cls, lines):
+    """Tokenizes many lines, like a whole game or file, in one call."""
+    # Strip the uncertainty marks from all lines at once.
+    cleaned_lines = '\n'.join(lines).translate(cls._UNCERTAINTY_MARKS).split('\n')
+    split = cls._split
+    intern = sys.intern
+    events = []
+    for line, cleaned_line in zip(lines, cleaned_lines):
+      parts = split(cleaned_line)
+      events.append(cls(intern(parts[0]), parts, line))
+    return events
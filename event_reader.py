@@ -0,0 +1,279 @@
+from atomic_write import atomic_write
+from event import Event
+from game_index import GameIndex
+from play import PlayCache
+from player import PITCH_TYPES, RESULT_TYPES
+from stats_tracker import PlayTally
+
+import array
+import hashlib
+import locale
+import mmap
+import os
+import pickle
+
+# Bump this whenever decoded games change shape, to invalidate old caches.
+# Caches also hold the counters that plays add to player stats, so they are
+# invalidated when the counters change too.
+_DECODED_CACHE_VERSION = (2, tuple(PITCH_TYPES), tuple(RESULT_TYPES))
+
+# Event files are decoded like open() would in text mode.
+_ENCODING = locale.getpreferredencoding(False)
+
+
+class EventReader(object):
+  """A cursor over the games of one event file, handed out one game at a
+  time.
+
+  The file is memory-mapped rather than read into a list of lines. Games are
+  found through the file's GameIndex, so peeking at the next game never
+  tokenizes anything, games that weren't asked for are never touched, and a
+  game's bytes are only decoded into lines when the game is read."""
+
+  def __init__(self, data, name=None, index=None, games=None):
+    """data is the file's contents, as bytes or an mmap. games are the
+    numbers of the games in index to read, by default all of them."""
+    self.name = name
+    self._data = data
+    # start, end and date of every game to read, in file order
+    self._game_offsets = []
+    self._game_ends = []
+    self._game_dates = []
+    # Lines before the first game, which are skipped.
+    self._preamble_end = 0
+    self._index_games(index, games)
+    self._next_game = 0
+
+  @classmethod
+  def from_file(cls, filename, games=None, data=None, index=None):
+    """A reader over an event file, or over data if the file's contents (or
+    some of its games) are already at hand, e.g. read out of an archive (see
+    data_files.py). index is the GameIndex of the file or data, if it was
+    already made."""
+    if data is not None:
+      return cls(data, name=filename, index=index or GameIndex.build(data), games=games)
+    with open(filename, 'rb') as f:
+      if os.fstat(f.fileno()).st_size == 0:
+        # Empty files can't be mapped.
+        data = b''
+      else:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return cls(data, name=filename, index=index or GameIndex.load(filename, data), games=games)
+
+  def _index_games(self, index, games):
+    if index is None:
+      index = GameIndex.build(self._data)
+    if games is None:
+      games = range(len(index))
+    for game in games:
+      self._game_offsets.append(index.offsets[game])
+      self._game_ends.append(index.offsets[game] + index.lengths[game])
+      self._game_dates.append(index.dates[game])
+    self._preamble_end = index.offsets[0] if len(index) else 0
+
+  def _span_lines(self, start, end):
+    # The lines in [start, end), stripped like lines read from a text file.
+    text = self._data[start:end].decode(_ENCODING)
+    # Universal newlines, like text mode.
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    if lines[-1] == '':
+      # The span ended with a line break.
+      lines.pop()
+    return [line.rstrip() for line in lines]
+
+  def has_next(self):
+    return self._next_game < len(self._game_offsets)
+
+  def peek_date(self):
+    """Date of the next unread game, or None if there are no games left."""
+    if not self.has_next():
+      return None
+    return self._game_dates[self._next_game]
+
+  def num_games(self):
+    return len(self._game_offsets)
+
+  def _preamble_lines(self):
+    # Lines before the first game.
+    return self._span_lines(0, self._preamble_end) if self._preamble_end else []
+
+  def _next_game_span(self):
+    # Offsets [start, end) of the next game, starting with its 'id' record.
+    # Advances the cursor past them.
+    assert self.has_next(), 'No games left in {}'.format(self.name)
+    if self._next_game == 0:
+      for line in self._preamble_lines():
+        print('Skipping line: {}'.format(line))
+    start = self._game_offsets[self._next_game]
+    end = self._game_ends[self._next_game]
+    self._next_game += 1
+    return start, end
+
+  def next_game(self):
+    """Returns the lines of the next game, starting with its 'id' record, and
+    advances the cursor past them."""
+    start, end = self._next_game_span()
+    return self._span_lines(start, end)
+
+  def next_game_events(self):
+    """Like next_game(), but returns the game's tokenized Events."""
+    return Event.from_lines(self.next_game())
+
+
+class DecodedGameReader(EventReader):
+  """An EventReader over games that were already tokenized, with their plays
+  decoded and tallied, see decode_event_file().
+
+  This is kept in a few flat arrays, so it is small and quick to send
+  between processes and to cache on disk: every distinct part of an event
+  (player ids, 'start', pitch sequences...), the parts of every event one
+  after another as numbers into those, where each event's parts start, the
+  number of each event's play tally (-1 if it isn't a play), and the tallies
+  of the distinct plays as columns (see PlayTally.to_columns()). Games are
+  indexed by event rather than by byte. Reading a game only makes its Events
+  out of the parts, and events of the same play share one PlayTally."""
+
+  def __init__(self, vocabulary, codes, event_starts, tally_numbers, game_starts, game_dates, tally_columns, preamble=(), name=None):
+    """Events' parts are vocabulary[code] for their codes. event_starts has
+    one more entry than there are events, where the codes of the last one
+    end. game_starts are the events the games start at."""
+    self._vocabulary = vocabulary
+    self._codes = codes
+    self._event_starts = event_starts
+    self._tally_numbers = tally_numbers
+    self._game_starts = game_starts
+    self._dates = game_dates
+    self._tally_columns = tally_columns
+    self._preamble = list(preamble)
+    self._tallies = PlayTally.from_columns(tally_columns)
+    EventReader.__init__(self, None, name=name)
+
+  def __getstate__(self):
+    # The tallies are quick to remake from their columns.
+    state = dict(self.__dict__)
+    del state['_tallies']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._tallies = PlayTally.from_columns(self._tally_columns)
+
+  def _index_games(self, index, games):
+    self._game_offsets = list(self._game_starts)
+    self._game_ends = self._game_offsets[1:] + [len(self._tally_numbers)]
+    self._game_dates = list(self._dates)
+
+  def _preamble_lines(self):
+    return self._preamble
+
+  def _span_events(self, start, end):
+    vocabulary = self._vocabulary
+    tallies = self._tallies
+    first = self._event_starts[start]
+    fields = [vocabulary[code] for code in self._codes[first:self._event_starts[end]]]
+    events = []
+    for part_start, part_end, tally_number in zip(self._event_starts[start:end], self._event_starts[start + 1:end + 1],
+                                                  self._tally_numbers[start:end]):
+      event = Event(fields[part_start - first], fields[part_start - first:part_end - first])
+      if tally_number >= 0:
+        event.tally = tallies[tally_number]
+      events.append(event)
+    return events
+
+  def next_game(self):
+    """The lines of the next game, put back together from their parts."""
+    return [','.join(event.parts) for event in self._span_events(*self._next_game_span())]
+
+  def next_game_events(self):
+    return self._span_events(*self._next_game_span())
+
+
+def decode_event_file(filename, games=None, data=None, index=None):
+  """Reads an event file, tokenizes it and decodes and tallies every play in
+  it, returning a DecodedGameReader over the result. games are the numbers of
+  the games in the file's GameIndex to read, by default all of them. data and
+  index are as in EventReader.from_file().
+
+  Nothing here depends on any other game, so unlike stats tracking this can
+  run on many files, or many parts of one file, at once in worker
+  processes."""
+  reader = EventReader.from_file(filename, games=games, data=data, index=index)
+  # Only a whole file keeps any lines before its first game.
+  preamble = reader._preamble_lines() if games is None else []
+  reader._preamble_end = 0
+  vocabulary = []
+  codes = array.array('i')
+  vocabulary_codes = {}  # part: its code
+  event_starts = array.array('i', [0])
+  tally_numbers = array.array('i')
+  game_starts = array.array('i')
+  game_dates = array.array('q')
+  tallies = []
+  tally_numbers_by_key = {}  # PlayCache.key_of(event): index into tallies
+  while reader.has_next():
+    game_starts.append(len(tally_numbers))
+    game_dates.append(reader.peek_date())
+    for event in reader.next_game_events():
+      for part in event.parts:
+        code = vocabulary_codes.get(part)
+        if code is None:
+          code = len(vocabulary)
+          vocabulary_codes[part] = code
+          vocabulary.append(part)
+        codes.append(code)
+      event_starts.append(len(codes))
+      if event.type != Event.Types.play:
+        tally_numbers.append(-1)
+        continue
+      key = PlayCache.key_of(event)
+      tally_number = tally_numbers_by_key.get(key)
+      if tally_number is None:
+        tally_number = len(tallies)
+        tally_numbers_by_key[key] = tally_number
+        tallies.append(PlayTally.from_event(event))
+      tally_numbers.append(tally_number)
+  if len(vocabulary) <= 2**16:
+    # Half the size, for the usual file with few distinct parts.
+    codes = array.array('H', codes)
+  return DecodedGameReader(vocabulary, codes, event_starts, tally_numbers, game_starts, game_dates,
+                           PlayTally.to_columns(tallies), preamble=preamble, name=filename)
+
+
+def load_decoded_event_file(filename, games=None, data=None, index=None, data_hash=None, cache_dir='decoded_cache', rebuild=False):
+  """Same as decode_event_file(), but reuses the result of an earlier run if
+  the event file hasn't changed since.
+
+  Decoded files are pickled under cache_dir, one per event file (or per
+  selection of its games), and are only reused if the event file's path,
+  size and modification time all still match. When given data, its hash
+  stands in for the size and modification time. Pass data_hash (the sha1 hex
+  digest of data) if it was already worked out. Set rebuild to decode and
+  re-cache regardless, e.g. after changing how plays are tallied."""
+  path = os.path.abspath(filename)
+  if data is None:
+    stat = os.stat(filename)
+    key = (_DECODED_CACHE_VERSION, path, stat.st_size, stat.st_mtime_ns, games)
+    name = path if games is None else '{}:{}'.format(path, games)
+  else:
+    if index is None:
+      index = GameIndex.build(data)
+    if data_hash is None:
+      data_hash = hashlib.sha1(data).hexdigest()
+    key = (_DECODED_CACHE_VERSION, path, data_hash, games)
+    # data may be only some of the file's games, e.g. one shard of it, so
+    # name the cache after the games it holds.
+    game_ids = index.game_ids if games is None else [index.game_ids[game] for game in games]
+    name = '{}:{}'.format(path, ','.join(game_ids))
+  cache_path = os.path.join(cache_dir, '{}_{}.p'.format(
+    os.path.basename(filename), hashlib.sha1(name.encode('utf-8')).hexdigest()[:12]))
+  if not rebuild and os.path.isfile(cache_path):
+    with open(cache_path, 'rb') as f:
+      if pickle.load(f) == key:
+        return pickle.load(f)
+  
+  reader = decode_event_file(filename, games=games, data=data, index=index)
+  os.makedirs(cache_dir, exist_ok=True)
+  with atomic_write(cache_path, 'wb') as f:
+    pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+    pickle.dump(reader, f, protocol=pickle.HIGHEST_PROTOCOL)
+  return reader
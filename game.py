@@ -1,47 +1,56 @@
 from event import Event
-from player import Player
+from stage_timers import stages
 from stats_tracker import StatsTracker
 
 import copy
 from collections import OrderedDict
 import numpy as np
+import time
 
 
 class Game(object):
-  def __init__(self, float_precision=True):
+  def __init__(self, float_precision=True, verbose=True):
     self.id = 0
     self.date = 0
     self.year = 0
     # [visiting team, home team]
     self.team_ids = [None, None]
     self.score = [0, 0]
-    self.initial_full_roster = [[], []]
-    self.initial_starting_roster = [[], []]
+    # roster style: [visiting team player vectors, home team player vectors]
+    self.rosters = OrderedDict()
     self.player_ids = [OrderedDict(), OrderedDict()]
     self.starting_player_ids = [OrderedDict(), OrderedDict()]
     # [ team 1 map of position:playerid, team 2 map of position:playerid]
     self.active_players = [{}, {}]
     # Use floats. Otherwise, uses ints.
     self.float_precision = float_precision
+    # Print a line for every game parsed and every sparse game.
+    self.verbose = verbose
     
     self._last_event_type = None
+    self._last_played_cache = {}  # team: whether each rostered player played the team's last game
     
-    self.good_sample = False
+    self.good_samples = {}  # roster style: whether it makes a good sample
+    self.updated_player_ids = []
     
   @classmethod
-  def peakNextDate(cls, lines):
-    """Given some lines from an event file, finds the date of the next game
-    in the lines."""
-    for line in lines:
-      event_line = Event.from_line(line)
-      if event_line.type == Event.Types.id:
-        return int(event_line.parts[1][3:])
-    return None
+  def peakNextDate(cls, reader):
+    """Given an EventReader over an event file, finds the date of the next
+    game without consuming it."""
+    return reader.peek_date()
     
-  def gobble(self, lines, persistent_stats_tracker, roster_style='participants', full_rosters=None, last_game_rosters=None):
-    """Given some lines from an event file, reads the plays for one game.
-    The lines are consumed, so you can call this repeatedly on a list of
-    events to parse out all the games."""
+  def gobble(self, reader, persistent_stats_tracker, roster_styles=['participants'], full_rosters=None, last_game_rosters=None):
+    """Given an EventReader (or DecodedGameReader) over an event file, reads
+    the plays for one game. full_rosters are the Rosters read from the roster
+    files.
+    The game is consumed, so you can call this repeatedly on a reader to
+    parse out all the games.
+    A roster is built for each of roster_styles (or a single style), all from
+    the same pass over the game."""
+    if isinstance(roster_styles, str):
+      roster_styles = [roster_styles]
+    for roster_style in roster_styles:
+      self.rosters[roster_style] = [[], []]
     
     # Note that persistent_stats_tracker shouldn't be touched until the end of the method,
     # since some code assumes this is pristine from before the game started.
@@ -49,44 +58,35 @@ class Game(object):
     game_stats_tracker = StatsTracker()
       
     # consumes event lines until the game appears to be over
-    while not self.id:
-      line = lines.pop(0)
-      id_event = Event.from_line(line)
-      if id_event.type == Event.Types.id:
-        self.id = id_event.parts[1]
-        print('Parsing game {}'.format(self.id), end='\r')
+    start = time.perf_counter()
+    events = reader.next_game_events()
+    stages.add_time('tokenize', time.perf_counter() - start)
+    stages.count('events', len(events))
+    for new_event in events:
+      if new_event.type == Event.Types.id:
+        self.id = new_event.parts[1]
+        if self.verbose:
+          print('Parsing game {}'.format(self.id), end='\r')
         self.date = int(self.id[3:])
         date_prefix = str(self.date)[:1]
         assert date_prefix in ['1', '2'], date_prefix # sanity check that year is like 19xx or 2xxx. TODO fix in 1k years.
         self.year = str(self.date)[:4]
-      else:
-        print('Skipping line: {}'.format(line))
-
-    while lines:
-      # If we've reached another game, don't consume the line.
-      line = lines[0]
-      new_event = Event.from_line(line)
-      if new_event.type == Event.Types.id:
-        break
-        
-      lines.pop(0)
+        continue
       
       if (self._last_event_type == Event.Types.start and
           new_event.type != Event.Types.start):
         for team in [0, 1]:
-          team_roster = full_rosters[self.year][self.team_ids[team]]
+          team_roster = full_rosters.team(self.year, self.team_ids[team])
+          last_played = self._last_played(team, team_roster, full_rosters, last_game_rosters)
           # record players for 'starters only' roster training
-          if roster_style == 'starters':
-            for player_id in self.player_ids[team]:
-              player_vector = self._player_vector(player_id, team, persistent_stats_tracker, team_roster, last_game_rosters)
-              self.initial_starting_roster[team].append(player_vector)
-          if roster_style in ['full', 'last']:
-            if roster_style == 'last':
-              # Filter the roster list to only include players who participated in the last game
-              team_roster = dict(filter(lambda elem: elem[0] in last_game_rosters[self.team_ids[team]], team_roster.items()))
-            for player_id in team_roster:
-              player_vector = self._player_vector(player_id, team, persistent_stats_tracker, team_roster, last_game_rosters)
-              self.initial_full_roster[team].append(player_vector)
+          if 'starters' in self.rosters:
+            starter_rows = [team_roster.rows[starter_id] for starter_id in self.player_ids[team]]
+            self.rosters['starters'][team].extend(self._player_vectors(starter_rows, team, persistent_stats_tracker, team_roster, last_played))
+          if 'full' in self.rosters:
+            self.rosters['full'][team].extend(self._player_vectors(np.arange(len(team_roster)), team, persistent_stats_tracker, team_roster, last_played))
+          if 'last' in self.rosters:
+            # Only include players who participated in the last game
+            self.rosters['last'][team].extend(self._player_vectors(np.flatnonzero(last_played), team, persistent_stats_tracker, team_roster, last_played))
       # note home and away teams
       if new_event.type == Event.Types.info:
         if new_event.parts[1] == 'visteam':
@@ -130,23 +130,29 @@ class Game(object):
     # the training data.
     # If we had no record of a player before this game, then sadly
     # we can't include them.
-    if roster_style == 'participants':
+    if 'participants' in self.rosters:
       for team in [0, 1]:
-        team_roster = full_rosters[self.year][self.team_ids[team]]
-        for player_id in self.player_ids[team]:
-          player_vector = self._player_vector(player_id, team, persistent_stats_tracker, team_roster, last_game_rosters)
-          self.initial_full_roster[team].append(player_vector)
+        team_roster = full_rosters.team(self.year, self.team_ids[team])
+        last_played = self._last_played(team, team_roster, full_rosters, last_game_rosters)
+        participant_rows = [team_roster.rows[participant_id] for participant_id in self.player_ids[team]]
+        self.rosters['participants'][team].extend(self._player_vectors(participant_rows, team, persistent_stats_tracker, team_roster, last_played))
           
     # maybe it helps to have the teams symetrical, ie with starters on the outside
     # when the arrays are concatinated later?
-    self.initial_full_roster[1].reverse()
-    self.initial_starting_roster[1].reverse()
+    for roster in self.rosters.values():
+      roster[1].reverse()
     
     self._set_quality(persistent_stats_tracker, self.player_ids)
+    start = time.perf_counter()
     persistent_stats_tracker.append(game_stats_tracker)
+    stages.add_time('merge', time.perf_counter() - start)
+    # players whose stats this game changed
+    self.updated_player_ids = list(game_stats_tracker.index)
   
   def _set_quality(self, stats_tracker, player_id_maps):
     good_players_min_per_team = 6
+    for roster_style in self.rosters:
+      self.good_samples[roster_style] = False
     for home, team_player_ids in enumerate(player_id_maps):
       good = 0
       for player_id in team_player_ids:
@@ -154,49 +160,73 @@ class Game(object):
         if stats_tracker.has_player(player_id):
           good += int(stats_tracker.get_player(player_id).good_sample())
       if good < good_players_min_per_team:
-        self.good_sample = False
-        print('Game {} is too sparse. Only {} well documented players on team {}.'.format(self.id, good, self.team_ids[home]))
-        return
-      elif len(self.initial_full_roster[home]) < good_players_min_per_team and len(self.initial_starting_roster[home]) < good_players_min_per_team:
-        self.good_sample = False
-        num_players = max(len(self.initial_full_roster[home]), len(self.initial_starting_roster[home]))
-        print('Game {} is too sparse. Only {} total players on team {}.'.format(self.id, num_players, self.team_ids[home]))
+        if self.verbose:
+          print('Game {} is too sparse. Only {} well documented players on team {}.'.format(self.id, good, self.team_ids[home]))
         return
-    self.good_sample = True
+    for roster_style, roster in self.rosters.items():
+      for home in [0, 1]:
+        if len(roster[home]) < good_players_min_per_team:
+          if self.verbose:
+            print('Game {} is too sparse. Only {} total players on team {} ({} roster).'.format(self.id, len(roster[home]), self.team_ids[home], roster_style))
+          break
+      else:
+        self.good_samples[roster_style] = True
+    
+  def _only_roster_style(self, roster_style):
+    # Defaults roster_style to the one style the game was parsed with.
+    if roster_style is None:
+      assert len(self.rosters) == 1, 'Game was parsed with several roster styles. Pick one.'
+      roster_style = next(iter(self.rosters))
+    return roster_style
     
-  def is_good_sample(self):
-    return self.good_sample
+  def is_good_sample(self, roster_style=None):
+    return self.good_samples[self._only_roster_style(roster_style)]
   
-  def _player_vector(self, player_id, home_or_visitor, stats_tracker, team_roster, last_game_rosters):
+  def _last_played(self, home_or_visitor, team_roster, full_rosters, last_game_rosters):
+    # Whether each player on team_roster played in the team's last game.
+    if home_or_visitor not in self._last_played_cache:
+      last_game_ids = last_game_rosters[self.team_ids[home_or_visitor]]
+      self._last_played_cache[home_or_visitor] = full_rosters.is_any_of(team_roster.numbers, last_game_ids)
+    return self._last_played_cache[home_or_visitor]
     
-    if stats_tracker.has_player(player_id):
-      player_vector = stats_tracker.get_player(player_id).to_vector(float_precision=self.float_precision)
-    else:
-      player_vector = Player(player_id).to_vector(float_precision=self.float_precision)
-    player_vector.extend(Player.hand_to_1_hot(team_roster[player_id]['batting_hand']))  # mark batting hand
-    player_vector.extend(Player.hand_to_1_hot(team_roster[player_id]['throwing_hand']))  # mark throwing hand
-    player_vector.append(int(player_id in last_game_rosters[self.team_ids[home_or_visitor]])) # mark 1 if player played last game
+  def _player_vectors(self, rows, home_or_visitor, stats_tracker, team_roster, last_played):
+    # Vectors of the players at rows of team_roster, as a list.
+    rows = np.asarray(rows, dtype=np.int64)
+    if not len(rows):
+      return []
+    start = time.perf_counter()
+    vectors = None
+    for i, row in enumerate(rows.tolist()):
+      # Stats vectors are cached until the player's stats change.
+      stats_vector = stats_tracker.player_vector(team_roster.player_ids[row], float_precision=self.float_precision)
+      if vectors is None:
+        num_stats = len(stats_vector)
+        vectors = np.empty((len(rows), num_stats + team_roster.hands.shape[1] + 2))
+      vectors[i, :num_stats] = stats_vector
+    vectors[:, num_stats:-2] = team_roster.hands_of(rows)  # mark batting hand, then throwing hand
+    vectors[:, -2] = last_played[rows]  # mark 1 if player played last game
     # It's important that this is last; some padding code assumes it.
-    player_vector.append(home_or_visitor)  # mark visitor/home
-    return np.array(player_vector)
+    vectors[:, -1] = home_or_visitor  # mark visitor/home
+    stages.add_time('vectorize', time.perf_counter() - start)
+    stages.count('player vectors', len(rows))
+    return list(vectors)
     
   def participant_ids(self):
     # useful for the 'last' roster strategy, where we assume the coach will play the same
     # players as the last game.
     return self.year, self.team_ids[0], self.player_ids[0], self.team_ids[1], self.player_ids[1]
           
-  def to_sample(self, starters_only=False):
+  def to_sample(self, roster_style=None):
     """Called after a game has been parsed, returns the initial stats of all
     players and the final score.
     
     Params
-      starters_only: train only on the list of starting players, discarding info on subs."""
+      roster_style: which of the game's rosters to sample. 'starters' trains
+        only on the list of starting players, discarding info on subs. May be
+        left out if the game was parsed with a single roster style."""
     assert self.id, 'It appears this game has not been populated. Cannot sample it.'      
      
-    if starters_only:
-      sample = self.initial_starting_roster[0] + self.initial_starting_roster[1]
-    else:
-      sample = self.initial_full_roster[0] + self.initial_full_roster[1]
+    roster = self.rosters[self._only_roster_style(roster_style)]
+    sample = roster[0] + roster[1]
     assert type(sample) == type([])
     return sample, self.score[0], self.score[1]
-    
\ No newline at end of file
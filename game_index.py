@@ -0,0 +1,162 @@
+from atomic_write import atomic_write
+from event import Event
+
+import json
+import os
+import re
+
+# Bump this whenever the index changes shape, to invalidate old indexes.
+_INDEX_VERSION = 1
+
+
+class GameIndex(object):
+  """Where every game of one event file is, and what it is: its game id,
+  date, visiting and home teams, and the byte offset and length of its
+  records. A game runs from its 'id' record up to the next game's, so the
+  games tile the file after any leading lines.
+
+  Building an index is one regex pass over the file, without tokenizing
+  anything. Indexes are saved next to the event files they cover (see
+  load()), so games in a date range or of some teams can be read by seeking
+  straight to them."""
+
+  # The records the index is built from.
+  _RECORD = re.compile(rb'^(id|info,visteam|info,hometeam),([^\r\n]*)', re.MULTILINE)
+
+  def __init__(self, game_ids, dates, visitors, homes, offsets, lengths):
+    self.game_ids = game_ids
+    self.dates = dates  # YYYYMMDDN, N being the game number of a double header
+    self.visitors = visitors
+    self.homes = homes
+    self.offsets = offsets
+    self.lengths = lengths
+
+  def __len__(self):
+    return len(self.game_ids)
+
+  @classmethod
+  def build(cls, data):
+    """Indexes the contents of an event file, as bytes or an mmap."""
+    game_ids, dates, visitors, homes, offsets = [], [], [], [], []
+    for match in GameIndex._RECORD.finditer(data):
+      record, value = match.group(1), match.group(2).decode('ascii', 'replace')
+      if record == b'id':
+        id_line = match.group(0).decode('ascii', 'replace')
+        game_id = Event.from_line(id_line).parts[1]
+        game_ids.append(game_id)
+        dates.append(int(game_id[3:]))
+        # Teams default to the one in the game id, in case info is missing.
+        visitors.append('')
+        homes.append(game_id[:3])
+        offsets.append(match.start())
+      elif not game_ids:
+        # info before the first game
+        continue
+      elif record == b'info,visteam':
+        visitors[-1] = value.strip()
+      else:
+        homes[-1] = value.strip()
+    ends = offsets[1:] + [len(data)]
+    lengths = [end - offset for offset, end in zip(offsets, ends)]
+    return cls(game_ids, dates, visitors, homes, offsets, lengths)
+
+  @staticmethod
+  def path(filename):
+    # In a subdir, so globs for event files don't pick indexes up.
+    return os.path.join(os.path.dirname(filename), 'game_index', os.path.basename(filename) + '.json')
+
+  @classmethod
+  def load(cls, filename, data=None):
+    """The index of an event file, from next to the file if it is still up to
+    date, otherwise built and saved there. Pass the file's contents as data
+    if they are already at hand."""
+    stat = os.stat(filename)
+    key = [_INDEX_VERSION, stat.st_size, stat.st_mtime_ns]
+    index_path = GameIndex.path(filename)
+    if os.path.isfile(index_path):
+      with open(index_path, 'r') as f:
+        saved = json.load(f)
+      if saved['key'] == key:
+        return cls(*[saved[column] for column in ['game_ids', 'dates', 'visitors', 'homes', 'offsets', 'lengths']])
+
+    if data is None:
+      with open(filename, 'rb') as f:
+        data = f.read()
+    index = cls.build(data)
+    saved = {
+      'key': key,
+      'game_ids': index.game_ids,
+      'dates': index.dates,
+      'visitors': index.visitors,
+      'homes': index.homes,
+      'offsets': index.offsets,
+      'lengths': index.lengths,
+    }
+    try:
+      os.makedirs(os.path.dirname(index_path), exist_ok=True)
+      with atomic_write(index_path) as f:
+        json.dump(saved, f)
+    except OSError as e:
+      # e.g. read-only data. The index still works, it just isn't kept.
+      print('Not saving game index of {}: {}'.format(filename, e))
+    return index
+
+  def select(self, start_date=None, end_date=None, teams=None):
+    """Numbers of the games from start_date to end_date (YYYYMMDD, both
+    inclusive) that one of teams played in. Any of them can be None to not
+    filter on it."""
+    games = []
+    for game, date in enumerate(self.dates):
+      day = date // 10
+      if start_date is not None and day < start_date:
+        continue
+      if end_date is not None and day > end_date:
+        continue
+      if teams is not None and self.visitors[game] not in teams and self.homes[game] not in teams:
+        continue
+      games.append(game)
+    return games
+
+  def spans(self, games):
+    """Byte ranges [start, end) of the given games, in order. Runs of
+    adjacent games are merged into one range."""
+    spans = []
+    for game in games:
+      start = self.offsets[game]
+      end = start + self.lengths[game]
+      if spans and spans[-1][1] == start:
+        spans[-1][1] = end
+      else:
+        spans.append([start, end])
+    return [tuple(span) for span in spans]
+
+  def subset(self, games):
+    """The index of just the given games (in order), as found in the bytes of
+    their spans() joined together."""
+    offsets = []
+    offset = 0
+    for game in games:
+      offsets.append(offset)
+      offset += self.lengths[game]
+    return GameIndex([self.game_ids[game] for game in games], [self.dates[game] for game in games],
+                     [self.visitors[game] for game in games], [self.homes[game] for game in games],
+                     offsets, [self.lengths[game] for game in games])
+
+  def in_date_order(self, games):
+    """Whether the given games (in file order) are sorted by date."""
+    dates = [self.dates[game] for game in games]
+    return all(date <= next_date for date, next_date in zip(dates, dates[1:]))
+
+  def shards(self, games, max_bytes):
+    """Splits games, in order, into runs of at most max_bytes of records
+    each (but at least one game), so one big file can be read by several
+    workers."""
+    shards = []
+    shard_bytes = 0
+    for game in games:
+      if not shards or shard_bytes + self.lengths[game] > max_bytes:
+        shards.append([])
+        shard_bytes = 0
+      shards[-1].append(game)
+      shard_bytes += self.lengths[game]
+    return shards
@@ -1,8 +1,8 @@
 from keras.models import Sequential, load_model
-from keras.layers import LSTM, Dense, Bidirectional, Dropout
+from keras.layers import Masking, LSTM, GRU, Dense, Bidirectional, Dropout
 from keras.callbacks.callbacks import EarlyStopping, ModelCheckpoint
 from keras import regularizers
-from training_helpers import LoadData, ShuffleCallback, TrainingArgs
+from training_helpers import ArraySequence, LoadData, LoadSequences, TrainingArgs
 
 import numpy as np
 import os
@@ -21,10 +21,30 @@ y_test = None
 
 # Read and pad data from disk
 print('Using labeled data found at {}'.format(args.parsed_data_prefix))
-x_train, x_validate, x_test, y_train, y_validate, y_test = LoadData(
-  args.parsed_data_prefix,
-  drop_fraction=args.drop_fraction, test_drop_fraction=args.test_drop_fraction,
-  validate_fraction=args.validate_fraction, test_fraction=args.test_fraction)
+if args.stream or args.bucket:
+  # Only the (small) test set is loaded into RAM. Training and validation
+  # batches are read from disk and padded as they are needed.
+  train_data, validate_data, test_data = LoadSequences(
+    args.parsed_data_prefix, args.batch_size, roster_shuffle=args.roster_shuffle, bucket=args.bucket,
+    drop_fraction=args.drop_fraction, test_drop_fraction=args.test_drop_fraction,
+    validate_fraction=args.validate_fraction, test_fraction=args.test_fraction)
+  x_test, y_test = test_data.all()
+  input_shape = x_test[0].shape
+  fit_data = dict(x=train_data, validation_data=validate_data,
+    workers=args.workers, use_multiprocessing=args.workers > 1)
+else:
+  x_train, x_validate, x_test, y_train, y_validate, y_test = LoadData(
+    args.parsed_data_prefix,
+    drop_fraction=args.drop_fraction, test_drop_fraction=args.test_drop_fraction,
+    validate_fraction=args.validate_fraction, test_fraction=args.test_fraction)
+  input_shape = x_train[0].shape
+  fit_data = dict(x=x_train, y=y_train, batch_size=args.batch_size,
+    validation_data=(x_validate, y_validate))
+  if args.roster_shuffle:
+    # Shuffle players batch by batch in a background thread, which shares
+    # the training set rather than copying it.
+    fit_data = dict(x=ArraySequence(x_train, y_train, args.batch_size, roster_shuffle=True),
+      validation_data=(x_validate, y_validate), workers=args.workers, use_multiprocessing=False)
   
 # Early stopping with patience
 early_stopper = EarlyStopping(monitor='val_loss', verbose=1, patience=args.patience)
@@ -32,13 +52,14 @@ model_checkpoint = ModelCheckpoint(args.model_path, monitor='val_loss',
   mode='min', save_best_only=True, verbose=1)
 callbacks = [early_stopper, model_checkpoint]
 if args.roster_shuffle:
+  # Batches are shuffled as they are read.
   print('Roster shuffling (data augmentation) enabled.')
-  callbacks.append(ShuffleCallback(x_train))
   
 # Define and train the model
-input_shape = x_train[0].shape
 model = Sequential()
-model.add(Bidirectional(GRU(args.rnn_layer_size, return_sequences=True, input_shape=input_shape, dropout=0.2, recurrent_dropout=0.2)))
+# Padding rows are all zeros. Skip them, so games can be padded to any length.
+model.add(Masking(mask_value=0., input_shape=(None, input_shape[-1])))
+model.add(Bidirectional(GRU(args.rnn_layer_size, return_sequences=True, dropout=0.2, recurrent_dropout=0.2)))
 for _ in range(args.num_rnn_layers - 2):
   model.add(Bidirectional(GRU(args.rnn_layer_size, return_sequences=True, dropout=0.0, recurrent_dropout=0.0)))
 model.add(Bidirectional(GRU(args.rnn_layer_size, dropout=0.0, recurrent_dropout=0.0)))
@@ -49,10 +70,9 @@ model.add(Dense(
   bias_regularizer=regularizers.l2(0.04)))
 model.compile(loss='mse', optimizer='adam', metrics=['accuracy'])
 
-model.fit(x_train, y_train,
-  epochs=args.max_epochs, batch_size=args.batch_size,
-  validation_data=(x_validate, y_validate), shuffle=True,
-  callbacks=callbacks)
+model.fit(
+  epochs=args.max_epochs, shuffle=True, callbacks=callbacks,
+  **fit_data)
 
 print('')
 print('*********************************')
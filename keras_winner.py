@@ -1,8 +1,8 @@
 from keras.models import Sequential, load_model
-from keras.layers import LSTM, Dense, Bidirectional, Dropout, BatchNormalization, Flatten, Conv1D, Activation
+from keras.layers import Masking, LSTM, Dense, Bidirectional, Dropout, BatchNormalization, Flatten, Conv1D, Activation
 from keras.callbacks.callbacks import EarlyStopping, ModelCheckpoint
 from keras import regularizers
-from training_helpers import LoadData, ShuffleCallback, TrainingArgs
+from training_helpers import ArraySequence, LoadData, LoadSequences, TrainingArgs
 
 import numpy as np
 import os
@@ -20,20 +20,38 @@ x_test = None
 y_train = None
 y_test = None
 
-# Read and pad data from disk
-print('Using labeled data found at {}'.format(args.parsed_data_prefix))
-x_train, x_validate, x_test, y_train, y_validate, y_test = LoadData(
-  args.parsed_data_prefix,
-  drop_fraction=args.drop_fraction, test_drop_fraction=args.test_drop_fraction,
-  validate_fraction=args.validate_fraction, test_fraction=args.test_fraction)
 # Label data comes in the form [visitors score, home score].
 # Condense to just a winner (0=visitors, 1=home).
-y_train = np.asarray(
-  [points[1] > points[0] for points in y_train], dtype=bool)
-y_validate = np.asarray(
-  [points[1] > points[0] for points in y_validate], dtype=bool)
-y_test = np.asarray(
-  [points[1] > points[0] for points in y_test], dtype=bool)
+def ToWinners(points):
+  return np.asarray(points[:, 1] > points[:, 0], dtype=bool)
+
+# Read and pad data from disk
+print('Using labeled data found at {}'.format(args.parsed_data_prefix))
+if args.stream or args.bucket:
+  # Only the (small) test set is loaded into RAM. Training and validation
+  # batches are read from disk and padded as they are needed.
+  train_data, validate_data, test_data = LoadSequences(
+    args.parsed_data_prefix, args.batch_size, label_fn=ToWinners, roster_shuffle=args.roster_shuffle, bucket=args.bucket,
+    drop_fraction=args.drop_fraction, test_drop_fraction=args.test_drop_fraction,
+    validate_fraction=args.validate_fraction, test_fraction=args.test_fraction)
+  x_test, y_test = test_data.all()
+  input_shape = x_test[0].shape
+  fit_data = dict(x=train_data, validation_data=validate_data,
+    workers=args.workers, use_multiprocessing=args.workers > 1)
+else:
+  x_train, x_validate, x_test, y_train, y_validate, y_test = LoadData(
+    args.parsed_data_prefix,
+    drop_fraction=args.drop_fraction, test_drop_fraction=args.test_drop_fraction,
+    validate_fraction=args.validate_fraction, test_fraction=args.test_fraction)
+  y_train, y_validate, y_test = ToWinners(y_train), ToWinners(y_validate), ToWinners(y_test)
+  input_shape = x_train[0].shape
+  fit_data = dict(x=x_train, y=y_train, batch_size=args.batch_size,
+    validation_data=(x_validate, y_validate))
+  if args.roster_shuffle:
+    # Shuffle players batch by batch in a background thread, which shares
+    # the training set rather than copying it.
+    fit_data = dict(x=ArraySequence(x_train, y_train, args.batch_size, roster_shuffle=True),
+      validation_data=(x_validate, y_validate), workers=args.workers, use_multiprocessing=False)
   
 # Early stopping with patience
 early_stopper = EarlyStopping(monitor='val_loss', verbose=1, patience=args.patience)
@@ -41,12 +59,13 @@ model_checkpoint = ModelCheckpoint(args.model_path, monitor='val_loss',
   mode='min', save_best_only=True, verbose=1)
 callbacks = [early_stopper, model_checkpoint]
 if args.roster_shuffle:
+  # Batches are shuffled as they are read.
   print('Roster shuffling (data augmentation) enabled.')
-  callbacks.append(ShuffleCallback(x_train))
   
 # Define and train the model
-input_shape = x_train[0].shape
 model = Sequential()
+# Padding rows are all zeros. Skip them, so games can be padded to any length.
+model.add(Masking(mask_value=0., input_shape=(None, input_shape[-1])))
 for _ in range(args.num_rnn_layers - 1):
   model.add(Bidirectional(LSTM(
     args.rnn_layer_size, return_sequences=True, dropout=0.0, recurrent_dropout=0.0)))
@@ -66,10 +85,9 @@ model.add(Activation('sigmoid'))
 model.compile(
   loss='binary_crossentropy', optimizer='adam', metrics=['accuracy'])
 
-model_history = model.fit(x_train, y_train,
-  epochs=args.max_epochs, batch_size=args.batch_size,
-  validation_data=(x_validate, y_validate), shuffle=True,
-  callbacks=callbacks)
+model_history = model.fit(
+  epochs=args.max_epochs, shuffle=True, callbacks=callbacks,
+  **fit_data)
                           
 loss = model_history.history['loss']
 val_loss = model_history.history['val_loss']
@@ -0,0 +1,148 @@
+"""Builds model inputs for games that haven't been played yet.
+
+parse.py saves a checkpoint of every player's stats after each season (see
+--incremental). A MatchupSampler loads that snapshot once and turns rosters
+of upcoming games into samples laid out exactly like the ones Game makes for
+training.
+"""
+from player import Player
+from rosters import Rosters
+from training_helpers import PadGames
+import data_files
+
+import numpy as np
+import pickle
+
+
+class MatchupSampler(object):
+  """Samples for any visiting roster against any home roster, from one
+  snapshot of player stats.
+
+  Like in Game, each player's row is their stats vector, their batting and
+  throwing hand one-hots, whether they played in their team's last game, and
+  finally whether they're on the home team. A sample is the visiting team's
+  rows followed by the home team's rows in reverse order."""
+
+  def __init__(self, stats_tracker, full_rosters, last_game_rosters, float_precision=False):
+    self.stats_tracker = stats_tracker
+    self.full_rosters = full_rosters
+    self.last_game_rosters = last_game_rosters
+    self.float_precision = float_precision
+    # Hands of every player as of their latest roster.
+    self._hands = {}  # player id: handedness one-hots
+    for year in full_rosters.years():
+      for team in full_rosters.teams(year):
+        team_roster = full_rosters.team(year, team)
+        for row, player_id in enumerate(team_roster.player_ids):
+          if team_roster.valid_hands[row]:
+            self._hands[player_id] = team_roster.hands[row]
+    # Players who played in any team's last game, for rosters without a team.
+    self._any_last_game = set()
+    for player_ids in last_game_rosters.values():
+      self._any_last_game.update(player_ids)
+    self._vectors = {}  # player id: stats and hands, without the last 2 marks
+    self._num_stats = len(stats_tracker.player_vector(None, float_precision)) + 2 * len(Player.HANDS) + 2
+
+  @classmethod
+  def from_checkpoint(cls, parsed_data_prefix, data_path, roster_path=None):
+    """The sampler for the stats at the end of the last season parsed into
+    parsed_data_prefix. Hands are read from the rosters under data_path, and
+    from a season dir or archive of rosters at roster_path, e.g. those of a
+    season that hasn't been played yet."""
+    with open(parsed_data_prefix + '_checkpoint.p', 'rb') as f:
+      checkpoint = pickle.load(f)
+    assert hasattr(checkpoint['stats'], 'counters'), 'Checkpoint was made by an older version. Please re-run parse.py.'
+    season_paths = data_files.season_paths(data_path)
+    if roster_path and roster_path not in season_paths:
+      season_paths.append(roster_path)
+    filenames = []
+    for season_path in season_paths:
+      filenames.extend(data_files.season_files(season_path, '*.ROS*'))
+    return cls(checkpoint['stats'], Rosters.from_files(filenames), checkpoint['last_game_rosters'],
+               float_precision=checkpoint['float_precision'])
+
+  def num_stats(self):
+    """Length of each player's row."""
+    return self._num_stats
+
+  def has_player(self, player_id):
+    return player_id in self._hands
+
+  def _player_vector(self, player_id):
+    vector = self._vectors.get(player_id)
+    if vector is None:
+      if player_id not in self._hands:
+        raise ValueError('Player {} is not on any roster'.format(player_id))
+      vector = np.concatenate([self.stats_tracker.player_vector(player_id, self.float_precision), self._hands[player_id]])
+      self._vectors[player_id] = vector
+    return vector
+
+  def _team_rows(self, player_ids, home_or_visitor, team=None):
+    # [players, stats] rows of one team, as in Game._player_vectors().
+    rows = np.empty((len(player_ids), self.num_stats()), dtype=np.float32)
+    if team is not None:
+      last_game = self.last_game_rosters.get(team, {})
+    else:
+      last_game = self._any_last_game
+    for i, player_id in enumerate(player_ids):
+      rows[i, :-2] = self._player_vector(player_id)
+      rows[i, -2] = player_id in last_game  # mark 1 if player played last game
+    rows[:, -1] = home_or_visitor  # mark visitor/home
+    return rows
+
+  def sample(self, visitor_ids, home_ids, visitor_team=None, home_team=None):
+    """The [players, stats] sample of a game between two rosters. Teams are
+    used to tell who played in each team's last game. Without them, anyone
+    who played in some team's last game counts."""
+    visitor_rows = self._team_rows(visitor_ids, 0, visitor_team)
+    home_rows = self._team_rows(home_ids, 1, home_team)
+    return np.concatenate([visitor_rows, home_rows[::-1]])
+
+  def padded(self, samples, padded_len=0):
+    """Samples as one [games, players, stats] batch, padded in the middle
+    like training data to their most players, or to padded_len if that's
+    more."""
+    lengths = np.array([len(sample) for sample in samples], dtype=np.int64)
+    ends = np.cumsum(lengths)
+    players = np.concatenate(samples) if samples else np.zeros((0, self.num_stats()), dtype=np.float32)
+    return PadGames(players, ends - lengths, ends, max(padded_len, int(lengths.max()) if len(lengths) else 0))
+
+
+class ScheduleSamples(object):
+  """Samples for a whole schedule of games between a fixed set of team
+  rosters, e.g. a coming season.
+
+  Every team's rows are built once, as a visitor and as the home team. Any
+  batch of games is then gathered out of those with array indexing, so
+  thousands of games take about as long as a few copies of their rows."""
+
+  def __init__(self, sampler, team_rosters):
+    """team_rosters are team: player ids."""
+    self.sampler = sampler
+    self.teams = list(team_rosters)
+    self._team_numbers = {team: i for i, team in enumerate(self.teams)}
+    # Visitor blocks of every team, then home blocks, one after another.
+    blocks = [sampler._team_rows(team_rosters[team], 0, team) for team in self.teams]
+    blocks += [sampler._team_rows(team_rosters[team], 1, team)[::-1] for team in self.teams]
+    self._rows = np.concatenate(blocks)
+    self._lengths = np.array([len(block) for block in blocks], dtype=np.int64)
+    self._starts = np.cumsum(self._lengths) - self._lengths
+
+  def team_numbers(self, teams):
+    missing = sorted(set(teams) - set(self._team_numbers))
+    if missing:
+      raise ValueError('No roster for team(s) {}'.format(', '.join(missing)))
+    return np.array([self._team_numbers[team] for team in teams], dtype=np.int64)
+
+  def padded(self, visitor_teams, home_teams, padded_len=0):
+    """[games, players, stats] samples of the games between visitor_teams[i]
+    and home_teams[i], padded like MatchupSampler.padded()."""
+    # Each game is two blocks: its visitors' then its home team's.
+    blocks = np.stack([self.team_numbers(visitor_teams), self.team_numbers(home_teams) + len(self.teams)], axis=1).ravel()
+    block_lengths = self._lengths[blocks]
+    block_offsets = np.cumsum(block_lengths) - block_lengths
+    rows = np.repeat(self._starts[blocks] - block_offsets, block_lengths) + np.arange(block_lengths.sum())
+    game_lengths = block_lengths.reshape(-1, 2).sum(axis=1)
+    ends = np.cumsum(game_lengths)
+    padded_len = max(padded_len, int(game_lengths.max()) if len(game_lengths) else 0)
+    return PadGames(self._rows[rows], ends - game_lengths, ends, padded_len)
@@ -1,162 +1,362 @@
 from stats_tracker import StatsTracker
+from atomic_write import atomic_write
+from event_reader import EventReader, decode_event_file, load_decoded_event_file
 from game import Game
+from game_index import GameIndex
+from sample_store import SampleStore, SampleStoreWriter
+from rosters import Rosters
+from scheduler import GameScheduler
+from stage_timers import Progress, format_mb, stages
+from stats_history import StatsHistory
+import data_files
 
 import argparse
 from collections import defaultdict
 from collections import OrderedDict
-import glob
-import numpy as np
+import cProfile
+import functools
+import hashlib
+import json
+import multiprocessing
 import os
 import pickle
-import os
+import time
+
+ROSTER_STYLES = ['starters', 'participants', 'full', 'last']
 
 parser = argparse.ArgumentParser()
 
 parser.add_argument('--parsed_data_prefix', action='store', default='.\\out', dest='parsed_data_prefix',
-                    help='Output path for training sample pickles')
+                    help='Output path prefix for the training sample store')
 parser.add_argument('--data_path', action='store', default='.\\data\\', dest='data_path',
                     help='Input data dir to parse')
-parser.add_argument('--roster_style', action='store', default='participants', dest='roster_style', choices=['starters', 'participants', 'full', 'last'],
-                    help='How to populate the roster of each team.')      
+parser.add_argument('--roster_style', action='store', default='participants', dest='roster_style',
+                    help='How to populate the roster of each team: one of {}, several separated by commas, or "all". '
+                         'Several styles are parsed in one pass, each saved under <parsed_data_prefix>_<style>.'.format(', '.join(ROSTER_STYLES)))      
 parser.add_argument('--f', action='store_true', default=False, dest='force',
                     help='Force overwrite of existing data.')
-parser.add_argument('--max_pickle_len', action='store', default=50000, dest='max_pickle_len',
-                    help='Max entries per pickle. May result in multiple pickles.', type=int)
+parser.add_argument('--incremental', action='store_true', default=False, dest='incremental',
+                    help='Resume from the last checkpoint and only parse seasons newer than it, appending their samples.')
 parser.add_argument('--float_precision', action='store_true', default=False, dest='float_precision',
-                    help='Max entries per pickle. May result in multiple pickles.')                     
+                    help='Store player stats as normalized floats rather than raw counts.')
+parser.add_argument('--workers', action='store', default=1, dest='workers',
+                    help='Worker processes for tokenizing events and decoding plays. Stats are still tracked sequentially.', type=int)
+parser.add_argument('--read_threads', action='store', default=4, dest='read_threads', type=int,
+                    help='Threads for reading event files out of zip archives.')
+parser.add_argument('--decode_cache_dir', action='store', default='', dest='decode_cache_dir',
+                    help='Dir to cache tokenized and decoded event files in, so re-runs can skip text parsing. Opt-in: '
+                         'tokenizing and decoding are a small part of a run (a warm cache saved about 5%% on synthetic data), '
+                         'and a season\'s cached files are held in memory while it is parsed.')
+parser.add_argument('--rebuild_decode_cache', action='store_true', default=False, dest='rebuild_decode_cache',
+                    help='Ignore any cached decoded event files and decode them again.')
+parser.add_argument('--start_date', action='store', default=None, dest='start_date', type=int,
+                    help='Only parse games on or after this date, as YYYYMMDD. Player stats only count parsed games.')
+parser.add_argument('--end_date', action='store', default=None, dest='end_date', type=int,
+                    help='Only parse games on or before this date, as YYYYMMDD.')
+parser.add_argument('--teams', action='store', default=None, dest='teams',
+                    help='Only parse games played by these teams, separated by commas, e.g. NYA,BOS.')
+parser.add_argument('--shard_mb', action='store', default=1.0, dest='shard_mb', type=float,
+                    help='With multiple workers, event files bigger than this many MB are split among them by game. '
+                         'Files whose games aren\'t sorted by date are never split, since that would change the order games are parsed in.')
+parser.add_argument('--stats_history', action='store_true', default=False, dest='stats_history',
+                    help='Also save every player\'s stats after each of their games, for "as of date" lookups with StatsHistory.')
+parser.add_argument('--quiet', action='store_true', default=False, dest='quiet',
+                    help='Don\'t print a line for every game. Progress is still printed every --progress_interval seconds.')
+parser.add_argument('--progress_interval', action='store', default=10.0, dest='progress_interval', type=float,
+                    help='Seconds between progress reports with throughput and time left in the season.')
+parser.add_argument('--profile', action='store', default='', dest='profile',
+                    help='Save cProfile stats of the whole run to this path, for e.g. pstats or snakeviz.')
 
 args = parser.parse_args()
+args.roster_styles = ROSTER_STYLES if args.roster_style == 'all' else args.roster_style.split(',')
+for roster_style in args.roster_styles:
+  if roster_style not in ROSTER_STYLES:
+    parser.error('Unknown roster style {}. Choose from {} or all.'.format(roster_style, ', '.join(ROSTER_STYLES)))
+if args.teams is not None:
+  args.teams = sorted(args.teams.split(','))
 
-def season_ongoing(season_event_file_lines):
-  # checks if there are any unparsed games left in the data files
-  for team in season_event_file_lines:
-    if Game.peakNextDate(team):
-      return True
-  return False
-  
 def data_from_roster_files():
   # Read the annual lineup for every team, found in .ROS data files
-  year_dirs = [f.path for f in os.scandir(args.data_path) if f.is_dir()]
-  year_dirs.sort()
-  rosters = OrderedDict() # year: team: [player1, player2, ...]
-  
+  year_dirs = data_files.season_paths(args.data_path)
+  filenames = []
   for year_dir in year_dirs:
     print('Processesing season {} rosters'.format(year_dir))
-    season_event_file_lines = []
+    filenames.extend(data_files.season_files(year_dir, '*.ROS*'))
+  return Rosters.from_files(filenames)
+  
+def season_tasks(year_dir):
+  # Arguments for reading each event file of a season, in file order: its
+  # filename, the games to read from it (None for all of them), its contents
+  # and its GameIndex. Contents are None for plain files, which are mapped
+  # where they are read, while archive members are read here in several
+  # threads. With multiple workers, big files are split into several tasks by
+  # game.
+  tasks = []
+  selecting = args.start_date is not None or args.end_date is not None or args.teams is not None
+  filenames = data_files.season_files(year_dir, '*.EV*')
+  if data_files.is_archive(year_dir):
+    contents = data_files.read_many(filenames, threads=args.read_threads)
+  else:
+    contents = [None] * len(filenames)
+  for filename, data in zip(filenames, contents):
+    index = GameIndex.load(filename) if data is None else GameIndex.build(data)
+    games = index.select(args.start_date, args.end_date, args.teams) if selecting else None
+    if args.workers <= 1 or not index.in_date_order(range(len(index)) if games is None else games):
+      # Games come out of the shards of a file in date order, which is only
+      # the file's order if the file is sorted by date. Files that aren't
+      # are read whole, so sharding never changes the output.
+      shards = [games]
+    else:
+      shards = index.shards(range(len(index)) if games is None else games, args.shard_mb * 2**20)
+      if games is None and len(shards) <= 1:
+        # Small enough to read whole.
+        shards = [None]
+    for shard in shards:
+      task = OrderedDict([('filename', filename), ('games', shard)])
+      if shard is None or len(shards) == 1:
+        task['data'] = data
+        task['index'] = index
+      elif data is not None:
+        # Only the shard's own bytes, with an index of just its games.
+        task['data'] = b''.join(data[start:end] for start, end in index.spans(shard))
+        task['index'] = index.subset(shard)
+        task['games'] = None
+      # Otherwise the shard is mapped out of the plain file, whose saved index
+      # is quicker to load than to send.
+      if args.decode_cache_dir and task.get('data') is not None:
+        # Hashed once here, rather than by every worker.
+        task['data_hash'] = hashlib.sha1(task['data']).hexdigest()
+      tasks.append(task)
+  return tasks
+  
+def read_task(read_event_file, task):
+  # The reader of one of season_tasks(). Pools only pass arguments by
+  # position.
+  return read_event_file(**task)
+  
+def read_seasons(year_dirs):
+  # Yields (year dir, event file readers) for each season. With multiple
+  # workers, every event file of a season is tokenized and has its plays
+  # decoded in a process pool, one season ahead of the caller. Shards of one
+  # file are separate readers, whose games the scheduler merges back in
+  # order. Decoded event files can be cached between runs.
+  if args.decode_cache_dir:
+    read_event_file = functools.partial(load_decoded_event_file, cache_dir=args.decode_cache_dir, rebuild=args.rebuild_decode_cache)
+  elif args.workers > 1:
+    read_event_file = decode_event_file
+  else:
+    read_event_file = EventReader.from_file
     
-    # read all rosters from this season to RAM
-    for filename in glob.glob(os.path.join(year_dir, '*.ROS*')):
-      with open(filename, 'r') as f:
-        roster_name = os.path.splitext(os.path.basename(filename))[0]
-        year = roster_name[-4:]
-        assert len(year) == 4
-        assert year[:2] in ['19', '20']
-        team = roster_name[0:-4]
-        if year not in rosters:
-          rosters[year] = {}
-        if team not in rosters[year]:
-          rosters[year][team] = OrderedDict()
-        
-        line_parts = [line.rstrip().split(',') for line in f]
-        for player_parts in line_parts:
-          player_id = player_parts[0]
-          batting_hand = player_parts[3]
-          throwing_hand = player_parts[4]
-          rosters[year][team][player_id] = {'batting_hand': batting_hand, 'throwing_hand': throwing_hand}
-        
-  return rosters
+  if args.workers <= 1:
+    for year_dir in year_dirs:
+      start = time.perf_counter()
+      readers = [read_event_file(**task) for task in season_tasks(year_dir)]
+      stages.add_time('read', time.perf_counter() - start)
+      yield year_dir, readers
+    return
+    
+  with multiprocessing.Pool(args.workers) as pool:
+    decode_season = lambda year_dir: pool.map_async(functools.partial(read_task, read_event_file), season_tasks(year_dir))
+    next_season = decode_season(year_dirs[0]) if year_dirs else None
+    for i, year_dir in enumerate(year_dirs):
+      season = next_season
+      # Only time spent waiting on the workers, or reading archives for
+      # them, counts.
+      start = time.perf_counter()
+      if i + 1 < len(year_dirs):
+        next_season = decode_season(year_dirs[i + 1])
+      readers = season.get()
+      stages.add_time('read', time.perf_counter() - start)
+      yield year_dir, readers
   
-def data_from_game_files():
-  # Read all games from data files.
-  year_dirs = [f.path for f in os.scandir(args.data_path) if f.is_dir()]
-  year_dirs.sort()
-  print('Years: {}'.format(year_dirs))
+def output_prefix(roster_style):
+  # Where the samples of a roster style go. A single style keeps the plain
+  # prefix.
+  if len(args.roster_styles) == 1:
+    return args.parsed_data_prefix
+  return '{}_{}'.format(args.parsed_data_prefix, roster_style)
+  
+def checkpoint_path():
+  return args.parsed_data_prefix + '_checkpoint.p'
+  
+def report_path():
+  return args.parsed_data_prefix + '_parse_report.json'
   
-  games = []
-  stats = StatsTracker()
+def save_checkpoint(season, stats, last_game_rosters, num_samples):
+  # Everything needed to resume parsing after this season with --incremental.
+  checkpoint = {
+    'season': season,
+    'stats': stats,
+    'last_game_rosters': last_game_rosters,
+    'num_samples': num_samples,
+    'roster_styles': args.roster_styles,
+    'float_precision': args.float_precision,
+    'start_date': args.start_date,
+    'end_date': args.end_date,
+    'teams': args.teams,
+    'stats_history': args.stats_history,
+  }
+  # An interrupted run keeps the old checkpoint.
+  with atomic_write(checkpoint_path(), 'wb') as f:
+    pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+  
+def load_checkpoint():
+  with open(checkpoint_path(), 'rb') as f:
+    checkpoint = pickle.load(f)
+  assert hasattr(checkpoint['stats'], 'counters'), 'Checkpoint was made by an older version. Use --f to start over.'
+  # Older checkpoints were all made without stats history.
+  checkpoint.setdefault('stats_history', False)
+  for setting in ['roster_styles', 'float_precision', 'start_date', 'end_date', 'teams', 'stats_history']:
+    assert checkpoint.get(setting) == getattr(args, setting), (
+      'Checkpoint was made with {}={}. Rerun with the same setting or use --f to start over.'.format(setting, checkpoint.get(setting)))
+  return checkpoint
+  
+def data_from_game_files(checkpoint=None):
+  # Read all games from data files, and append the samples of each season to
+  # the output as it finishes. If given a checkpoint, picks up after the last
+  # season it covers.
+  year_dirs = data_files.season_paths(args.data_path)
+  
+  if checkpoint:
+    stats = checkpoint['stats']
+    last_game_rosters = checkpoint['last_game_rosters']
+    num_samples = checkpoint['num_samples']
+    print('Resuming after season {} ({} samples saved so far)'.format(checkpoint['season'], num_samples))
+    year_dirs = [year_dir for year_dir in year_dirs if data_files.season_name(year_dir) > checkpoint['season']]
+  else:
+    stats = StatsTracker()
+    last_game_rosters = defaultdict(dict)
+    num_samples = {}
+    # History of an earlier run would be out of step with the new samples,
+    # even if this run doesn't record any.
+    StatsHistory.remove(args.parsed_data_prefix)
+  print('Years: {}'.format(year_dirs))
   
   full_rosters = data_from_roster_files()
-  last_game_rosters = defaultdict(dict)
+  writers = OrderedDict((roster_style, SampleStoreWriter(output_prefix(roster_style), num_saved=num_samples.get(roster_style, 0)))
+                        for roster_style in args.roster_styles)
+  history = StatsHistory() if args.stats_history else None
+  num_games = 0
+  example_player = None
+  season_reports = []
   
-  for year_dir in year_dirs:
+  # read all games from each season to RAM
+  for year_dir, season_readers in read_seasons(year_dirs):
     print('Processesing season {}'.format(year_dir))
     
-    initial_num_games = len(games)
-    season_event_file_lines = []
-    
-    # read all games from this season to RAM
-    for filename in glob.glob(os.path.join(year_dir, '*.EV*')):
-      with open(filename, 'r') as f:
-        season_event_file_lines.append([line.rstrip() for line in f])
+    season_games = 0
+    season_samples = defaultdict(int)
+    progress = Progress(data_files.season_name(year_dir), sum(reader.num_games() for reader in season_readers), interval=args.progress_interval)
           
     # Parse the season's games in chronological order
-    # TODO: this is pretty inefficient
-    while season_ongoing(season_event_file_lines):
-      next_game_dates = []
-      for team_event_file_lines in season_event_file_lines:
-        next_game_date = Game.peakNextDate(team_event_file_lines)
-        next_game_dates.append(next_game_date)
-      next_game_dates = np.array(next_game_dates, dtype=np.float)
-        
-      next_game_team_idx = np.nanargmin(next_game_dates)
-      if next_game_dates[next_game_team_idx] == np.NaN:
-        continue
-      
-      next_game_lines = season_event_file_lines[next_game_team_idx]
-      # pass lines to game gobbler
-      new_game = Game(float_precision=args.float_precision)
-      new_game.gobble(next_game_lines, stats, roster_style=args.roster_style, full_rosters=full_rosters, last_game_rosters=last_game_rosters)
-      games.append(new_game)
+    for reader in GameScheduler(season_readers):
+      # pass the next game's events to game gobbler
+      new_game = Game(float_precision=args.float_precision, verbose=not args.quiet)
+      new_game.gobble(reader, stats, roster_styles=args.roster_styles, full_rosters=full_rosters, last_game_rosters=last_game_rosters)
+      season_games += 1
       #print('Finished parsing game {} with score {}'.format(new_game.id, new_game.score))
       # track players for each team for the 'last' roster strategy
       _, visitor_team, visitor_ids, home_team, home_ids = new_game.participant_ids()
       last_game_rosters[visitor_team] = visitor_ids
       last_game_rosters[home_team] = home_ids
+      if history:
+        history.record(new_game.date, stats, new_game.updated_player_ids)
       
-    num_games = len(games)
-    print('Parsed {} more games ({} total)'.format(num_games-initial_num_games, num_games))
+      # Stream the samples out now, rather than holding on to the game.
+      start = time.perf_counter()
+      for roster_style, writer in writers.items():
+        if new_game.is_good_sample(roster_style):
+          sample, visitor_label, home_label = new_game.to_sample(roster_style)
+          writer.append(sample, [visitor_label, home_label], new_game.id)
+          season_samples[roster_style] += 1
+          if sample:
+            example_player = sample[-1]
+      stages.add_time('write', time.perf_counter() - start)
+      progress.update(season_games)
+      
+    num_games += season_games
+    stages.count('games', season_games)
+    progress.update(season_games, force=True)
+    season_reports.append(OrderedDict([
+      ('season', data_files.season_name(year_dir)),
+      ('games', season_games),
+      ('games_per_second', progress.games_per_second(season_games)),
+      ('samples', OrderedDict((roster_style, season_samples[roster_style]) for roster_style in writers)),
+    ]))
+    print('Parsed {} more games ({} total)'.format(season_games, num_games))
+    for roster_style in writers:
+      print('Purged {} out of {} games due to sparse player stats ({} rosters).'.format(
+        season_games-season_samples[roster_style], season_games, roster_style))
+    
+    # Everything up to the end of the season must be on disk before the
+    # checkpoint claims it is.
+    start = time.perf_counter()
+    for writer in writers.values():
+      writer.flush()
+    stages.add_time('write', time.perf_counter() - start)
+    if history:
+      history.save(args.parsed_data_prefix, data_files.season_name(year_dir))
+    num_samples = {roster_style: writer.num_samples for roster_style, writer in writers.items()}
+    save_checkpoint(data_files.season_name(year_dir), stats, last_game_rosters, num_samples)
     
+  for writer in writers.values():
+    writer.close()
   print('')
   print('***Done parsing game events***')
-  print('Total games parsed: {}'.format(len(games)))
-  
-  samples = []
-  labels = []
-  game_ids = []
-  for game in games:
-    if game.is_good_sample():
-      sample, visitor_label, home_label = game.to_sample(starters_only=args.roster_style=='starters')
-      samples.append(sample)
-      labels.append([visitor_label, home_label])
-      game_ids.append(game.id)
-      
-  print('Purged {} out of {} games due to sparse player stats.'.format(len(games)-len(samples), len(games)))
+  print('Total games parsed: {}'.format(num_games))
+  if StatsTracker.play_cache.hits or StatsTracker.play_cache.misses:
+    print('Play cache hit rate: {:.1f}% ({} distinct plays decoded)'.format(
+      StatsTracker.play_cache.hit_rate()*100, StatsTracker.play_cache.misses))
     
-  print('Example player stats:')
-  print(samples[-1][-1])
+  if example_player is not None:
+    print('Example player stats:')
+    print(example_player)
+    
+  save_report(season_reports)
+  
+  return OrderedDict((roster_style, writer.num_samples) for roster_style, writer in writers.items())
   
-  return samples, labels, game_ids
+def save_report(season_reports):
+  # Prints where the time went, and saves it along with the other stage
+  # timers and counters as JSON.
+  report = stages.report()
+  report['total_seconds'] = time.perf_counter() - start_time
+  report['games_per_second'] = stages.counts.get('games', 0) / report['total_seconds']
+  # Mostly tallying stats, which is spread too thin to time separately.
+  report['seconds']['other'] = report['total_seconds'] - sum(report['seconds'].values())
+  report['seasons'] = season_reports
+  report['play_cache_hit_rate'] = StatsTracker.play_cache.hit_rate()
+  with open(report_path(), 'w') as f:
+    json.dump(report, f, indent=2)
+  
+  print('Took {:.1f}s, {:.1f} games/s, peak memory {}'.format(report['total_seconds'], report['games_per_second'], format_mb(report['peak_rss_mb'])))
+  for stage, seconds in report['seconds'].items():
+    print('  {:<10} {:8.2f}s {:5.1f}%'.format(stage, seconds, 100 * seconds / report['total_seconds']))
+  print('Report saved to {}'.format(report_path()))
 
 def main():
-  
-  if not args.force and (os.path.isfile(args.sample_path) or os.path.isfile(args.label_path)):
-    print('ERROR: Parsed game data already exists. Please use --f if you are intentionally recreating it.')
+  checkpoint = None
+  if args.incremental and os.path.isfile(checkpoint_path()):
+    checkpoint = load_checkpoint()
+  elif not args.force and any(SampleStore.exists(output_prefix(roster_style)) for roster_style in args.roster_styles):
+    print('ERROR: Parsed game data already exists. Please use --f if you are intentionally recreating it, or --incremental to add new seasons to it.')
+    return
   else:
     print('No saved training data found. Generating from raw game files.')
-    samples, labels, game_ids = data_from_game_files()
-    assert samples
-    assert labels
-    assert len(samples) == len(labels), '{} vs {}'.format(len(samples), len(labels))
-    print('Generated {} training samples'.format(len(samples)))
-    # save for later model training.
-    for i in range(int(len(labels)/args.max_pickle_len) + 1):
-      # Save data in chunks to avoid OOM errors during pickling.
-      start = i*args.max_pickle_len
-      end = (i+1)*args.max_pickle_len
-      pickle.dump(labels[start:end], open(args.parsed_data_prefix + '_labels_{}.p'.format(i), 'wb'))
-      pickle.dump(samples[start:end], open(args.parsed_data_prefix + '_samples_{}.p'.format(i), 'wb'))
-      pickle.dump(game_ids[start:end], open(args.parsed_data_prefix + '_gameids_{}.p'.format(i), 'wb'))
+    
+  num_samples = data_from_game_files(checkpoint)
+  for roster_style, style_samples in num_samples.items():
+    assert style_samples, 'No {} samples'.format(roster_style)
+    print('Generated {} training samples with {} rosters at {}'.format(style_samples, roster_style, output_prefix(roster_style)))
+
+# Wall time of the whole run starts here, before rosters are read.
+start_time = time.perf_counter()
 
 if __name__ == "__main__":
+  if args.profile:
+    profiler = cProfile.Profile()
+    profiler.runcall(main)
+    profiler.dump_stats(args.profile)
+    print('Profile saved to {}'.format(args.profile))
+  else:
     main()
-
@@ -1,7 +1,19 @@
 from event import Event
 
+from collections import OrderedDict
 import re
 
+_DIGIT = re.compile('[0-9]')
+_LEADING_LETTERS = re.compile('^[a-zA-Z]*')
+_LEADING_CAPITALS = re.compile('^[A-Z]*')
+_LEADING_DIGITS = re.compile('^[0-9]*')
+_LEADING_DIGIT = re.compile('^[0-9]')
+_ERROR_POSITIONS = re.compile('E[0-9]*')
+_TWO_DIGITS = re.compile('[0-9]{2}')
+_FOUR_DIGITS = re.compile('[0-9]{4}')
+_PARENTHETICAL = re.compile(r'\(.*\)')
+_ADVANCE = re.compile('[0-3B][-X][0-3H]')
+
 class Play(object):
   """A single game play. Build one using Play.from_event() and then you can
   access the high-level results of the play like points, outs, runner
@@ -23,7 +35,7 @@ class Play(object):
     self.raw_event = None
     
   def _parenthetical_field_pos(self):
-    fielders = re.findall('([0-9])', self.result)
+    fielders = _DIGIT.findall(self.result)
     if fielders:
       return set(int(x) for x in fielders[0].strip('()'))
     else:
@@ -52,10 +64,10 @@ class Play(object):
     modifiers = play_details[1:]
     if basic_play[0].isalpha():
       # starts with letters, optionally followed by num: on base, fielded by num
-      new_play.result = re.findall('^[a-zA-Z]*', basic_play)[0]
+      new_play.result = _LEADING_LETTERS.findall(basic_play)[0]
       if new_play.result in ['E', 'FLE']:
         # track who made an error
-        error_positions = re.findall('E[0-9]*', basic_play)
+        error_positions = _ERROR_POSITIONS.findall(basic_play)
         for error_pos in error_positions:
           for error in error_pos:
             if error.isdigit():
@@ -66,9 +78,9 @@ class Play(object):
         new_play.error_positions.add(int(play_details[1][1]))
       elif new_play.result[0] == 'K':
         new_play.outs += 1
-        if re.findall('[0-9]{4}', new_play.result):
+        if _FOUR_DIGITS.findall(new_play.result):
           new_play.outs += 2
-        elif re.findall('[0-9]{2}', new_play.result):
+        elif _TWO_DIGITS.findall(new_play.result):
           new_play.outs += 1
       elif new_play.result in ['H', 'HR']:
         # Home run
@@ -87,7 +99,7 @@ class Play(object):
         new_play.fielders_involved = new_play._parenthetical_field_pos()
       elif new_play.result.startswith('FLE'):
         # error on foul ball
-        fielders = re.findall('[0-9]', new_play.result)
+        fielders = _DIGIT.findall(new_play.result)
         if fielders:
           new_play.error_positions = set(int(x) for x in fielders[0].strip('()'))
       else:
@@ -98,12 +110,12 @@ class Play(object):
         # Remove parts in parenthesis, they're for doubles or something.
         # TODO: handle doubles etc.
         new_play.outs += 1
-        basic_play = re.sub('\(.*\)', ' ', basic_play)
-        new_play.fielders_involved = re.findall('[0-9]', basic_play)
+        basic_play = _PARENTHETICAL.sub(' ', basic_play)
+        new_play.fielders_involved = _DIGIT.findall(basic_play)
         new_play.fielders_involved = set([int(pos) for pos in new_play.fielders_involved]) 
     elif basic_play[0].isdigit():
       # starts with a number: out by those fielders
-      new_play.fielders_involved = re.findall('^[0-9]*', basic_play)[0]
+      new_play.fielders_involved = _LEADING_DIGITS.findall(basic_play)[0]
       new_play.fielders_involved = list(new_play.fielders_involved)
       new_play.fielders_involved = [int(pos) for pos in new_play.fielders_involved]
       new_play.result = new_play.fielders_involved[-1]
@@ -115,8 +127,7 @@ class Play(object):
       advances = play_components[1].split(';')
       for advance in advances:
         # pull out the parenthesis, where fielders are credited
-        fielding_regex = '\(.*\)'
-        fielders = re.findall(fielding_regex, advance)
+        fielders = _PARENTHETICAL.findall(advance)
         if fielders:
           for i, fielder in enumerate(fielders[0]):
             if i > 0 and fielders[0][i-1] == 'E':
@@ -125,11 +136,11 @@ class Play(object):
             elif fielder.isdigit():
               new_play.fielders_involved.add(int(fielder))
           
-        advance = re.sub(fielding_regex, '', advance)
+        advance = _PARENTHETICAL.sub('', advance)
       
         # advances look like [1-H] or [2x3] etc.
-        assert re.match('[0-3B][-X][0-3H]', advance), advance
-        if re.search('-H', advance):
+        assert _ADVANCE.match(advance), advance
+        if '-H' in advance:
           new_play.points[new_play.team_at_bat] += 1
         if advance in ['1-2', '2-3', '3-H']:
           new_play.runner_advancement += 1
@@ -145,9 +156,9 @@ class Play(object):
         elif advance in ['3-1']:
           # Yeesh, I hope this hasn't happened.
           new_play.runner_advancement -= 2
-        elif re.search('X', advance):
+        elif 'X' in advance:
           new_play.outs += 1
-        elif re.search('B-', advance):
+        elif 'B-' in advance:
           # TODO. indicates the batter should have been out but for a fielding error.
           pass
         else:
@@ -160,11 +171,70 @@ class Play(object):
     # double hit to a specific location.
     assert new_play.result
     new_play.result = str(new_play.result)
-    new_play.result = re.findall('^[A-Z]*', new_play.result)[0] or re.findall('^[0-9]', new_play.result)[0]
+    new_play.result = _LEADING_CAPITALS.findall(new_play.result)[0] or _LEADING_DIGIT.findall(new_play.result)[0]
     
     if new_play.result == 'I':
       new_play.result = 'IW'  # dedup notations for intentional walk
     
     return new_play
     
-   
\ No newline at end of file
+   
+
+class PlayCache(object):
+  """A bounded, least-recently-used cache of decoded plays.
+
+  The play column is massively repetitive across games ('K', '63/G', 'W'...),
+  so plays are decoded once per distinct (team at bat, pitches, play) and
+  shared after that. Only those fields of the event affect the decoded
+  result. Plays are decoded by decode, by default into a Play. Cached plays
+  don't keep their raw_event, since it is only one of the events they stand
+  for, and must not be mutated.
+
+  This cache only lasts one run. Reusing decoded plays across runs is up to
+  the decode cache (see load_decoded_event_file() and parse.py's
+  --decode_cache_dir), which is opt-in: it only saves tokenizing and
+  decoding, a small part of a run, at the cost of holding a season's cached
+  files in memory."""
+
+  def __init__(self, max_size=200000, decode=None):
+    self.max_size = max_size
+    self._decode = decode or PlayCache._decode_play
+    self._plays = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  @staticmethod
+  def key_of(play_event):
+    """The fields of a play event that decoding depends on."""
+    _, _, team_at_bat, _, _, pitches, play = play_event.parts
+    return (team_at_bat, pitches, play)
+
+  @staticmethod
+  def _decode_play(play_event):
+    play = Play.from_event(play_event)
+    play.raw_event = None
+    return play
+
+  def from_event(self, play_event):
+    """Same as decode(play_event), but only decodes novel plays."""
+    key = PlayCache.key_of(play_event)
+    cached_play = self._plays.get(key)
+    if cached_play is None:
+      self.misses += 1
+      cached_play = self._decode(play_event)
+      self._plays[key] = cached_play
+      if len(self._plays) > self.max_size:
+        self._plays.popitem(last=False)
+    else:
+      self.hits += 1
+      self._plays.move_to_end(key)
+    return cached_play
+
+  def hit_rate(self):
+    lookups = self.hits + self.misses
+    return self.hits / lookups if lookups else 0.0
+
+  def clear(self):
+    self._plays.clear()
+    self.hits = 0
+    self.misses = 0
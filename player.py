@@ -1,157 +1,218 @@
-from collections import OrderedDict
+import numpy as np
+
+# Every player's stats are raw integer counters, kept in one row of a
+# StatsTracker's matrix. The columns of a row are laid out as:
+#   batting counters   (NUM_AT_BAT_COUNTERS)
+#   pitching counters  (NUM_AT_BAT_COUNTERS)
+#   fielding counters  (4 * NUM_FIELD_POSITIONS)
+PITCH_TYPES = ['+', '*', '.', '1', '2', '3', '>', 'B', 'C', 'F', 'H', 'I', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'X', 'Y']
+# A list rather than a set, so that the order of results in player vectors
+# doesn't change from run to run.
+RESULT_TYPES = ['1', '2', '3', '4', '5', '6', '7', '8', '9', 'S', 'D', 'T', 'HR', 'W', 'HP', 'K', 'E', 'SB', 'BK', 'WP', 'FC', 'IW', 'DGR']
+# Batting and pitching counters: one per pitch type and result type, then
+# these totals.
+_AT_BAT_TOTALS = ['pitches_thrown', 'at_bats', 'points', 'outs', 'runner_advancement']
+NUM_AT_BAT_COUNTERS = len(PITCH_TYPES) + len(RESULT_TYPES) + len(_AT_BAT_TOTALS)
+_PITCH_COLUMNS = {pitch: i for i, pitch in enumerate(PITCH_TYPES)}
+_RESULT_COLUMNS = {result: len(PITCH_TYPES) + i for i, result in enumerate(RESULT_TYPES)}
+_TOTAL_COLUMNS = {total: len(PITCH_TYPES) + len(RESULT_TYPES) + i for i, total in enumerate(_AT_BAT_TOTALS)}
+
+# Fielding counters: plays, outs, errors and points, each per position.
+NUM_FIELD_POSITIONS = 12
+FIELDING_PLAYS = 0
+FIELDING_OUTS = NUM_FIELD_POSITIONS
+FIELDING_ERRORS = 2 * NUM_FIELD_POSITIONS
+FIELDING_POINTS = 3 * NUM_FIELD_POSITIONS
+
+BATTING = 0
+PITCHING = NUM_AT_BAT_COUNTERS
+FIELDING = 2 * NUM_AT_BAT_COUNTERS
+NUM_COUNTERS = FIELDING + 4 * NUM_FIELD_POSITIONS
+
+# at bat counters of recently seen plays, see at_bat_counts()
+_at_bat_counts_cache = {}
+_AT_BAT_COUNTS_CACHE_SIZE = 200000
+
+
+def at_bat_counts(play, play_event=None):
+  """The batting (or pitching) counters that a play adds to the batter (or
+  pitcher), as an array of NUM_AT_BAT_COUNTERS. Result counters are never
+  incremented, as has always been the case. play_event is the event the play
+  came from, for errors, if the play doesn't note it (like shared plays of a
+  PlayCache)."""
+  key = (tuple(play.pitches), play.result, tuple(play.points), play.outs, play.runner_advancement)
+  counts = _at_bat_counts_cache.get(key)
+  if counts is not None:
+    return counts
+
+  assert play.result
+  assert play.result in _RESULT_COLUMNS, play.result
+  counts = np.zeros(NUM_AT_BAT_COUNTERS, dtype=np.int32)
+  for pitch in play.pitches:
+    if pitch == 'a': continue  # known bad data in TOR201908170
+    if pitch not in _PITCH_COLUMNS:
+      raise Exception('Unrecognized pitch {} in event {}'.format(pitch, play_event if play_event is not None else play.raw_event))
+    counts[_PITCH_COLUMNS[pitch]] += 1
+    counts[_TOTAL_COLUMNS['pitches_thrown']] += 1
+  counts[_TOTAL_COLUMNS['at_bats']] = 1
+  counts[_TOTAL_COLUMNS['points']] = sum(play.points)
+  counts[_TOTAL_COLUMNS['outs']] = play.outs
+  counts[_TOTAL_COLUMNS['runner_advancement']] = play.runner_advancement
+
+  if len(_at_bat_counts_cache) >= _AT_BAT_COUNTS_CACHE_SIZE:
+    _at_bat_counts_cache.clear()
+  _at_bat_counts_cache[key] = counts
+  return counts
+
 
 class Player(object):
-  def __init__(self, id):
+  """A view of one player's stats.
+
+  A player made by a StatsTracker reads its counters straight out of the
+  tracker's matrix, so it is cheap to make and always up to date. A player
+  made on its own has stats of its own: the given counters, or all zeros."""
+
+  def __init__(self, id, tracker=None, counters=None):
     self.id = id # to be hidden from model?)
-    
-    self.batting = BattingStats()
+    self._tracker = tracker
+    if tracker is None:
+      if counters is None:
+        counters = np.zeros(NUM_COUNTERS, dtype=np.int32)
+      self._counters = counters
+
+    self.batting = BattingStats(self, BATTING)
     self.fielding = FieldingStats(self)
-    self.pitching = PitchingStats()
-    
+    self.pitching = PitchingStats(self, PITCHING)
+
     #age?
     #contract status? :)
-    
+
+  @property
+  def counters(self):
+    """This player's row of raw counters, see NUM_COUNTERS."""
+    if self._tracker is None:
+      return self._counters
+    return self._tracker.counters[self._tracker.index[self.id]]
+
   def append(self, o):
     """Adds results from other object o"""
-    self.batting.append(o.batting)
-    self.fielding.append(o.fielding)
-    self.pitching.append(o.pitching)
-    
+    counters = self.counters
+    counters += o.counters
+
   def to_vector(self, float_precision=True):
     return self.batting.to_vector(float_precision=float_precision) + self.fielding.to_vector(float_precision=float_precision) + self.fielding.to_vector(float_precision=float_precision)
-    
+
   def good_sample(self):
     # Whether there is enough info on this player to be a good sample.
     return self.batting.at_bats > 20 or self.pitching.at_bats > 50
-    
+
+  HANDS = ['L', 'R', 'B']
+  
   @staticmethod
   def hand_to_1_hot(hand):
     # converts handedness (right, left, both) to a 1 hot vector
-    hands = ['L', 'R', 'B']
-    assert hand in hands, hand
-    return [int(hand == h) for h in hands]
-    
+    assert hand in Player.HANDS, hand
+    return [int(hand == h) for h in Player.HANDS]
     
+  @staticmethod
+  def hands_to_1_hot(batting_hand, throwing_hand):
+    # 1 hot batting hand followed by 1 hot throwing hand, as a numpy array
+    return np.array(Player.hand_to_1_hot(batting_hand) + Player.hand_to_1_hot(throwing_hand))
+
+
 class FieldingStats(object):
+  """A view of a player's fielding counters."""
 
   def __init__(self, player):
-    self.NUM_FIELD_POSITIONS = 12
-    self.plays_per_position = [0] * self.NUM_FIELD_POSITIONS
-    self.outs_per_position = [0] * self.NUM_FIELD_POSITIONS
-    self.errors_per_position = [0] * self.NUM_FIELD_POSITIONS
-    self.points_per_position = [0] * self.NUM_FIELD_POSITIONS
-    self._current_field_position = -1
+    self.NUM_FIELD_POSITIONS = NUM_FIELD_POSITIONS
     self.player = player
-    
-  def set_position(self, position):
-    self._current_field_position = position
-    
-  def unassign_position(self, old_position):
-    if old_position == self._current_field_position:
-      self._current_field_position = -2
-    
-  def error(self):
-    assert self._current_field_position > 0, self.player.id
-    self.errors_per_position[self._current_field_position-1] += 1
-    
-  def participated(self):
-    assert self._current_field_position > 0, self.player.id
-    self.plays_per_position[self._current_field_position-1] += 1
-    
-  def update(self, play):
-    assert self._current_field_position > 0, self.player.id
-    self.plays_per_position[self._current_field_position-1] += 1
-    self.outs_per_position[self._current_field_position-1] += play.outs
-    self.points_per_position[self._current_field_position-1] += sum(play.points)
-    if self._current_field_position in play.error_positions:
-      self.errors_per_position[self._current_field_position-1] += 1
-    
+
+  def _counters(self, first):
+    start = FIELDING + first
+    return self.player.counters[start:start + NUM_FIELD_POSITIONS]
+
+  @property
+  def plays_per_position(self):
+    return self._counters(FIELDING_PLAYS)
+
+  @property
+  def outs_per_position(self):
+    return self._counters(FIELDING_OUTS)
+
+  @property
+  def errors_per_position(self):
+    return self._counters(FIELDING_ERRORS)
+
+  @property
+  def points_per_position(self):
+    return self._counters(FIELDING_POINTS)
+
   def to_vector(self, float_precision):
     if float_precision:
       return self.to_float_vector()
     else:
       return self.to_int_vector()
-    
+
   def to_float_vector(self):
-    # If any stats are added here, make sure they are also tracked in the
-    # append method.
-    return ([p / 10000 for p in self.plays_per_position] +
+    plays = self.plays_per_position
+    return (np.concatenate([plays / 10000,
       # outs and errors per play, per fielding position. Add 1 to denom to avoid zero division.
-      [o / (p+1) for o, p in zip(self.outs_per_position, self.plays_per_position)] +
-      [e / (p+1) for e, p in zip(self.errors_per_position, self.plays_per_position)])
-      
+      self.outs_per_position / (plays + 1),
+      self.errors_per_position / (plays + 1)]).tolist())
+
   def to_int_vector(self):
-    # If any stats are added here, make sure they are also tracked in the
-    # append method.
-    return self.plays_per_position + self.outs_per_position + self.errors_per_position
-    
-  def append(self, o):
-    """Adds results from other object o"""
-    for p in range(self.NUM_FIELD_POSITIONS):
-      self.plays_per_position[p] += o.plays_per_position[p]
-      self.outs_per_position[p] += o.outs_per_position[p]
-      self.errors_per_position[p] += o.errors_per_position[p]
-      self.points_per_position[p] += o.points_per_position[p]
-    
-    
+    return self.player.counters[FIELDING:FIELDING + FIELDING_POINTS].tolist()
+
+
 class PitchingStats(object):
+  """A view of a player's pitching counters, which start at column offset of
+  the player's row."""
+
+  def __init__(self, player, offset):
+    self.player = player
+    self.offset = offset
+
+  def _counters(self):
+    return self.player.counters[self.offset:self.offset + NUM_AT_BAT_COUNTERS]
+
+  def _total(self, total):
+    return int(self.player.counters[self.offset + _TOTAL_COLUMNS[total]])
+
+  @property
+  def at_bats(self):
+    return self._total('at_bats')
+
+  @property
+  def pitches_thrown(self):
+    return self._total('pitches_thrown')
+
+  @property
+  def points(self):
+    return self._total('points')
+
+  @property
+  def outs(self):
+    return self._total('outs')
+
+  @property
+  def runner_advancement(self):
+    return self._total('runner_advancement')
 
-  def __init__(self):
-    _PITCH_TYPES = ['+', '*', '.', '1', '2', '3', '>', 'B', 'C', 'F', 'H', 'I', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'X', 'Y']
-    self.raw_pitches = OrderedDict(zip(_PITCH_TYPES, [0] * len(_PITCH_TYPES)))
-    
-    self._RESULT_TYPES = set(['1', '2', '3', '4', '5', '6', '7', '8', '9', 'S', 'D', 'T', 'HR', 'W', 'HP', 'K', 'E', 'SB', 'BK', 'WP', 'FC', 'IW', 'DGR'])
-    self.results = OrderedDict(zip(self._RESULT_TYPES, [0] * len(self._RESULT_TYPES)))
-  
-    self.pitches_thrown = 0
-    self.at_bats = 0
-    self.points = 0
-    self.outs = 0
-    self.runner_advancement = 0
-    
-  def append(self, o):
-    """Adds results from other object o"""
-    for p in o.raw_pitches:
-      self.raw_pitches[p] += o.raw_pitches[p]
-    for r in o.results:
-      self.results[r] += o.results[r]
-    self.pitches_thrown += o.pitches_thrown
-    self.at_bats += o.at_bats
-    self.points += o.points
-    self.outs += o.outs
-    self.runner_advancement += o.runner_advancement
-    
-  def update(self, play):
-    assert play.result
-    assert play.result in self._RESULT_TYPES, play.result
-    for pitch in play.pitches:
-      if pitch == 'a': continue  # known bad data in TOR201908170
-      if pitch not in self.raw_pitches:
-        raise Exception('Unrecognized pitch {} in event {}'.format(pitch, play.raw_event))
-      self.raw_pitches[pitch] += 1
-      self.pitches_thrown += 1
-    self.at_bats += 1
-    self.points += sum(play.points)
-    self.outs += play.outs
-    self.runner_advancement += play.runner_advancement
-    
   def to_vector(self, float_precision):
-    # If any stats are added here, make sure they are also tracked in the
-    # append method.
+    counters = self._counters()
     at_bats_smoothed = 1
     if float_precision:
       at_bats_smoothed = self.at_bats + 1  # Add 1 to denom to avoid zero division.
     at_bats_denominator = 1
     if float_precision:
       at_bats_denominator = 10000  # typical number to get this in range of ~1
-    return ([p / at_bats_smoothed for p in self.raw_pitches.values()] +
-            [r / at_bats_smoothed for r in self.results.values()] +
-            [self.pitches_thrown / at_bats_denominator,
-             self.at_bats / at_bats_denominator,
-             self.points/at_bats_smoothed,
-             self.outs/at_bats_smoothed,
-             self.runner_advancement/at_bats_smoothed])  
-    
+    vector = counters / at_bats_smoothed
+    # Pitches thrown and at bats are totals rather than rates.
+    for total in ['pitches_thrown', 'at_bats']:
+      column = _TOTAL_COLUMNS[total]
+      vector[column] = counters[column] / at_bats_denominator
+    return vector.tolist()
+
 class BattingStats(PitchingStats):
   # Can I say battings stats just the equivalent of pitching stats, but
   # attributed to the batter rather than the pitcher?
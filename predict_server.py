@@ -0,0 +1,251 @@
+"""Serves predictions of a trained model over HTTP.
+
+The model and the latest player stats (the checkpoint parse.py saves) are
+loaded once at startup. POST a game's rosters as JSON to /predict:
+
+  curl -d '{"visitor": ["troum001", ...], "home": ["judga001", ...],
+            "visitor_team": "ANA", "home_team": "NYA"}' localhost:8000/predict
+
+and get back the model's output for it, e.g. {"prediction": [0.61]} from
+winner_model.h5, the chance that the home team wins. Teams are optional, see
+MatchupSampler.sample(). GET /stats reports request latencies.
+
+Requests that arrive while the model is busy are batched together into the
+next model.predict() call, which is far faster than predicting games one by
+one.
+"""
+from keras.models import load_model
+from matchups import MatchupSampler
+
+import argparse
+import asyncio
+from collections import deque
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+
+import numpy as np
+
+HTTP_STATUSES = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class LatencyStats(object):
+  """Latencies of the most recent requests, and how they were batched."""
+
+  def __init__(self, window=10000):
+    self._latencies = deque(maxlen=window)  # seconds
+    self.requests = 0
+    self.batches = 0
+
+  def add_batch(self, latencies):
+    self._latencies.extend(latencies)
+    self.requests += len(latencies)
+    self.batches += 1
+
+  def report(self):
+    report = OrderedDict([
+      ('requests', self.requests),
+      ('batches', self.batches),
+      ('mean_batch_size', self.requests / self.batches if self.batches else None),
+    ])
+    for percentile in [50, 99]:
+      latency = np.percentile(self._latencies, percentile) * 1000 if self._latencies else None
+      report['p{}_ms'.format(percentile)] = latency
+    return report
+
+
+class MicroBatcher(object):
+  """Collects samples from concurrent requests and runs them through the
+  model together.
+
+  A batch is whatever is waiting when the model is free, up to max_batch
+  samples, after waiting at most max_wait seconds for more to arrive. The
+  model runs in its own thread, so requests keep being accepted (and queue
+  up for the next batch) while it works."""
+
+  def __init__(self, model, sampler, max_batch=256, max_wait=0.002, padded_len=0):
+    self.model = model
+    self.sampler = sampler
+    self.max_batch = max_batch
+    self.max_wait = max_wait
+    self.padded_len = padded_len
+    self.stats = LatencyStats()
+    self._queue = asyncio.Queue()
+    # Keras models aren't safe to call from several threads at once.
+    self._executor = ThreadPoolExecutor(max_workers=1)
+
+  async def predict(self, sample):
+    """The model's output for one sample, once its batch is done."""
+    future = asyncio.get_running_loop().create_future()
+    await self._queue.put((sample, future, time.perf_counter()))
+    return await future
+
+  async def run(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      batch = [await self._queue.get()]
+      deadline = loop.time() + self.max_wait
+      while len(batch) < self.max_batch:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+          break
+        try:
+          batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+        except asyncio.TimeoutError:
+          break
+      try:
+        await self._run_batch(loop, batch)
+      except Exception as e:
+        # Whatever went wrong only fails this batch's requests. The batcher
+        # keeps serving the next ones.
+        for _, future, _ in batch:
+          if not future.done():
+            future.set_exception(e)
+
+  async def _run_batch(self, loop, batch):
+    samples = [sample for sample, _, _ in batch]
+    predictions = await loop.run_in_executor(self._executor, self._predict, samples)
+    done = time.perf_counter()
+    for (_, future, start), prediction in zip(batch, predictions):
+      # Requests whose handler was cancelled while waiting have no one to
+      # answer.
+      if not future.done():
+        future.set_result(prediction)
+    self.stats.add_batch([done - start for _, _, start in batch])
+
+  def _predict(self, samples):
+    x = self.sampler.padded(samples, self.padded_len)
+    return self.model.predict(x, batch_size=len(samples))
+
+
+async def read_request(reader):
+  # (method, path, body) of an HTTP request, or None if the client left.
+  request_line = await reader.readline()
+  if not request_line:
+    return None
+  method, path, _ = request_line.decode('latin-1').split(' ', 2)
+  content_length = 0
+  while True:
+    header = await reader.readline()
+    if header in [b'\r\n', b'\n', b'']:
+      break
+    name, _, value = header.decode('latin-1').partition(':')
+    if name.strip().lower() == 'content-length':
+      content_length = int(value)
+  body = await reader.readexactly(content_length) if content_length else b''
+  return method, path, body
+
+
+def write_response(writer, status, body):
+  body = json.dumps(body).encode('utf-8')
+  writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'.format(
+    status, HTTP_STATUSES[status], len(body)).encode('latin-1'))
+  writer.write(body)
+
+
+class PredictionServer(object):
+  def __init__(self, batcher):
+    self.batcher = batcher
+
+  async def handle(self, reader, writer):
+    # One connection, which may send several requests.
+    try:
+      while True:
+        request = await read_request(reader)
+        if request is None:
+          break
+        status, body = await self._respond(*request)
+        write_response(writer, status, body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+      pass
+    finally:
+      writer.close()
+
+  async def _respond(self, method, path, body):
+    if path == '/stats':
+      return 200, self.batcher.stats.report()
+    if path != '/predict':
+      return 404, {'error': 'Unknown path {}'.format(path)}
+    if method != 'POST':
+      return 405, {'error': 'POST rosters to /predict'}
+    try:
+      game = json.loads(body)
+      sample = self.batcher.sampler.sample(game['visitor'], game['home'], game.get('visitor_team'), game.get('home_team'))
+    except KeyError as e:
+      return 400, {'error': 'Missing {}'.format(e)}
+    except (TypeError, ValueError) as e:
+      return 400, {'error': str(e)}
+    try:
+      prediction = await self.batcher.predict(sample)
+    except Exception as e:
+      return 500, {'error': str(e)}
+    return 200, {'prediction': np.asarray(prediction).tolist()}
+
+
+async def report_latency(stats, interval):
+  # Prints the latency report every interval seconds there were requests.
+  last_requests = 0
+  while True:
+    await asyncio.sleep(interval)
+    if stats.requests != last_requests:
+      last_requests = stats.requests
+      report = stats.report()
+      print('{} requests in {} batches (mean batch size {:.1f}), latency p50 {:.1f}ms, p99 {:.1f}ms'.format(
+        report['requests'], report['batches'], report['mean_batch_size'], report['p50_ms'], report['p99_ms']))
+
+
+async def serve(args, model, sampler):
+  batcher = MicroBatcher(model, sampler, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000, padded_len=args.padded_len)
+  server = PredictionServer(batcher)
+  if args.unix_socket:
+    listener = await asyncio.start_unix_server(server.handle, path=args.unix_socket)
+    print('Listening on {}'.format(args.unix_socket))
+  else:
+    listener = await asyncio.start_server(server.handle, args.host, args.port)
+    print('Listening on http://{}:{}'.format(args.host, args.port))
+  tasks = [asyncio.ensure_future(batcher.run()), asyncio.ensure_future(report_latency(batcher.stats, args.report_interval))]
+  try:
+    async with listener:
+      await listener.serve_forever()
+  finally:
+    for task in tasks:
+      task.cancel()
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--model_path', action='store', default='winner_model.h5', dest='model_path',
+                      help='Trained model to serve')
+  parser.add_argument('--parsed_data_prefix', action='store', default='.\\out', dest='parsed_data_prefix',
+                      help='Prefix the data was parsed to. Player stats are read from its checkpoint.')
+  parser.add_argument('--data_path', action='store', default='.\\data\\', dest='data_path',
+                      help='Data dir with the roster files, for players\' handedness')
+  parser.add_argument('--host', action='store', default='127.0.0.1', dest='host')
+  parser.add_argument('--port', action='store', default=8000, dest='port', type=int)
+  parser.add_argument('--unix_socket', action='store', default='', dest='unix_socket',
+                      help='Listen on this Unix socket instead of host and port')
+  parser.add_argument('--max_batch', action='store', default=256, dest='max_batch', type=int,
+                      help='Most games per model.predict() call')
+  parser.add_argument('--max_wait_ms', action='store', default=2.0, dest='max_wait_ms', type=float,
+                      help='How long a batch waits for more requests once it has one')
+  parser.add_argument('--padded_len', action='store', default=0, dest='padded_len', type=int,
+                      help='Pad games to at least this many players. Only needed for models without a Masking layer, '
+                           'which must get as many players as they were trained on.')
+  parser.add_argument('--report_interval', action='store', default=60.0, dest='report_interval', type=float,
+                      help='Seconds between latency reports')
+  args = parser.parse_args()
+
+  print('Loading player stats from {}'.format(args.parsed_data_prefix))
+  sampler = MatchupSampler.from_checkpoint(args.parsed_data_prefix, args.data_path)
+  print('Loading model from {}'.format(args.model_path))
+  model = load_model(args.model_path)
+  try:
+    asyncio.run(serve(args, model, sampler))
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,130 @@
+from player import Player
+import data_files
+
+from collections import OrderedDict
+import numpy as np
+import os
+
+
+class TeamRoster(object):
+  """One team's roster for one season, in roster file order.
+
+  Players are stored as arrays, so picking players out of the roster is
+  array indexing: their interned numbers (see Rosters), and their batting
+  and throwing hands as the one-hots used in player vectors."""
+
+  def __init__(self, player_ids, numbers, batting_hands, throwing_hands):
+    self.player_ids = player_ids
+    self.numbers = numbers
+    self.rows = {player_id: row for row, player_id in enumerate(player_ids)}
+    self._batting_hands = batting_hands
+    self._throwing_hands = throwing_hands
+    self.hands = np.zeros((len(player_ids), 2 * len(Player.HANDS)))
+    # Players with hands that aren't recognized get an error when used, not
+    # when the roster is read.
+    self.valid_hands = np.zeros(len(player_ids), dtype=bool)
+    for row, (batting_hand, throwing_hand) in enumerate(zip(batting_hands, throwing_hands)):
+      if batting_hand in Player.HANDS and throwing_hand in Player.HANDS:
+        self.hands[row] = Player.hands_to_1_hot(batting_hand, throwing_hand)
+        self.valid_hands[row] = True
+
+  def __len__(self):
+    return len(self.player_ids)
+
+  def __contains__(self, player_id):
+    return player_id in self.rows
+
+  def hands_of(self, rows):
+    """[players, 6] handedness one-hots of the players at rows."""
+    for row in np.flatnonzero(~self.valid_hands[rows]):
+      row = rows[row]
+      Player.hands_to_1_hot(self._batting_hands[row], self._throwing_hands[row])
+    return self.hands[rows]
+
+
+class Rosters(object):
+  """Every team's roster for every season, as read from the .ROS files.
+
+  Player id strings are interned to dense integers, numbered in the order
+  they are first seen, so sets of players can be compared with numpy."""
+
+  def __init__(self):
+    self.numbers = {}  # player id: number
+    self.player_ids = []  # number: player id
+    self._teams = OrderedDict()  # year: team: TeamRoster
+    # scratch space for is_any_of(), one flag per number
+    self._marks = np.zeros(0, dtype=bool)
+
+  @classmethod
+  def from_files(cls, filenames):
+    """Reads .ROS roster files, named like ANA2019.ROS. They can be in
+    archives, see data_files.py."""
+    rosters = OrderedDict() # year: team: player id: (batting hand, throwing hand)
+    for filename in filenames:
+      with data_files.open_text(filename) as f:
+        roster_name = os.path.splitext(os.path.basename(filename))[0]
+        year = roster_name[-4:]
+        assert len(year) == 4
+        assert year[:2] in ['19', '20']
+        team = roster_name[0:-4]
+        if year not in rosters:
+          rosters[year] = {}
+        if team not in rosters[year]:
+          rosters[year][team] = OrderedDict()
+        
+        for line in f:
+          player_parts = line.rstrip().split(',')
+          player_id = player_parts[0]
+          batting_hand = player_parts[3]
+          throwing_hand = player_parts[4]
+          rosters[year][team][player_id] = (batting_hand, throwing_hand)
+        
+    # Intern player ids and index each roster.
+    indexed_rosters = cls()
+    for year, teams in rosters.items():
+      for team, players in teams.items():
+        indexed_rosters.add_team(year, team, players)
+    return indexed_rosters
+
+  def intern(self, player_id):
+    number = self.numbers.get(player_id)
+    if number is None:
+      number = len(self.player_ids)
+      self.numbers[player_id] = number
+      self.player_ids.append(player_id)
+    return number
+
+  def numbers_of(self, player_ids):
+    """Numbers of the given players as an array, -1 for players that aren't
+    on any roster."""
+    return np.array([self.numbers.get(player_id, -1) for player_id in player_ids], dtype=np.int64)
+
+  def is_any_of(self, numbers, player_ids):
+    """For each of numbers, whether it is the number of one of player_ids.
+    Like np.isin(), but by indexing, which is much faster for roster sized
+    arrays."""
+    if len(self._marks) < len(self.player_ids):
+      self._marks = np.zeros(len(self.player_ids), dtype=bool)
+    marked = self.numbers_of(player_ids)
+    marked = marked[marked >= 0]
+    self._marks[marked] = True
+    result = self._marks[numbers]
+    self._marks[marked] = False
+    return result
+
+  def add_team(self, year, team, players):
+    """players is an ordered map of player id: (batting hand, throwing hand)."""
+    player_ids = list(players)
+    numbers = np.array([self.intern(player_id) for player_id in player_ids], dtype=np.int64)
+    batting_hands = [hands[0] for hands in players.values()]
+    throwing_hands = [hands[1] for hands in players.values()]
+    self._teams.setdefault(year, OrderedDict())[team] = TeamRoster(player_ids, numbers, batting_hands, throwing_hands)
+
+  def team(self, year, team):
+    return self._teams[year][team]
+
+  def teams(self, year):
+    return list(self._teams[year])
+
+  def years(self):
+    return list(self._teams)
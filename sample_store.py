@@ -0,0 +1,138 @@
+from atomic_write import atomic_write
+
+import json
+import numpy as np
+import os
+
+# Game ids look like ANA201904040. Leave some slack.
+_GAME_ID_DTYPE = np.dtype('S16')
+
+
+class SampleStore(object):
+  """Read-only, memory-mapped access to the training samples written by
+  SampleStoreWriter.
+
+  Samples are stored column by column rather than pickled:
+    <prefix>_players.bin   float32 [total players, stats per player], every
+                           game's players one after another
+    <prefix>_offsets.bin   int64 [games], the row in the players matrix just
+                           past each game's last player
+    <prefix>_labels.bin    int32 [games, 2], [visitor score, home score]
+    <prefix>_gameids.bin   game id strings
+    <prefix>_store.json    counts and shapes of the above
+  Opening a store reads almost nothing, and several processes reading the same
+  store share its pages."""
+
+  def __init__(self, prefix):
+    with open(SampleStore.header_path(prefix), 'r') as f:
+      header = json.load(f)
+    self.num_stats = header['num_stats']
+    num_games = header['num_games']
+    num_rows = header['num_rows']
+    self.players = SampleStore._map(prefix, 'players', np.float32, (num_rows, self.num_stats))
+    ends = SampleStore._map(prefix, 'offsets', np.int64, (num_games,))
+    self.offsets = np.concatenate([[0], ends])
+    self.labels = SampleStore._map(prefix, 'labels', np.int32, (num_games, 2))
+    self.game_ids = SampleStore._map(prefix, 'gameids', _GAME_ID_DTYPE, (num_games,))
+
+  @staticmethod
+  def path(prefix, column):
+    return prefix + '_{}.bin'.format(column)
+
+  @staticmethod
+  def header_path(prefix):
+    return prefix + '_store.json'
+
+  @staticmethod
+  def exists(prefix):
+    return os.path.isfile(SampleStore.header_path(prefix))
+
+  @staticmethod
+  def _map(prefix, column, dtype, shape):
+    if not np.prod(shape):
+      # Empty files can't be mapped.
+      return np.zeros(shape, dtype=dtype)
+    return np.memmap(SampleStore.path(prefix, column), dtype=dtype, mode='r', shape=shape)
+
+  def __len__(self):
+    return len(self.labels)
+
+  def game(self, i):
+    """The [players, stats] matrix of game i. This is a view, not a copy."""
+    return self.players[self.offsets[i]:self.offsets[i + 1]]
+
+  def num_players(self):
+    """Number of players in every game."""
+    return np.diff(self.offsets)
+
+
+class SampleStoreWriter(object):
+  """Appends training samples to a SampleStore as games are parsed. Nothing is
+  held in RAM beyond file buffers."""
+
+  _COLUMNS = ['players', 'offsets', 'labels', 'gameids']
+
+  def __init__(self, prefix, num_saved=0):
+    """Given that num_saved samples were already written under prefix,
+    continues after them. Anything on disk beyond num_saved is left over from
+    an interrupted run, and is cut off."""
+    self.prefix = prefix
+    self.num_samples = num_saved
+    self.num_stats = None
+    self._num_rows = 0
+    if num_saved:
+      store = SampleStore(prefix)
+      assert len(store) >= num_saved, 'Store {} has only {} of {} samples'.format(prefix, len(store), num_saved)
+      self.num_stats = store.num_stats
+      self._num_rows = int(store.offsets[num_saved])
+      sizes = {
+        'players': self._num_rows * self.num_stats * np.dtype(np.float32).itemsize,
+        'offsets': num_saved * np.dtype(np.int64).itemsize,
+        'labels': num_saved * 2 * np.dtype(np.int32).itemsize,
+        'gameids': num_saved * _GAME_ID_DTYPE.itemsize,
+      }
+      del store
+      for column in SampleStoreWriter._COLUMNS:
+        with open(SampleStore.path(prefix, column), 'r+b') as f:
+          f.truncate(sizes[column])
+      mode = 'ab'
+    else:
+      mode = 'wb'
+    self._files = {column: open(SampleStore.path(prefix, column), mode) for column in SampleStoreWriter._COLUMNS}
+    self._write_header()
+
+  def append(self, sample, label, game_id):
+    """Adds one game: a list of player vectors, [visitor score, home score] and
+    the game id."""
+    players = np.asarray(sample, dtype=np.float32)
+    if len(players):
+      if self.num_stats is None:
+        self.num_stats = players.shape[1]
+      assert players.shape[1] == self.num_stats, '{} stats per player, expected {}'.format(players.shape[1], self.num_stats)
+      self._num_rows += len(players)
+      self._files['players'].write(players.tobytes())
+    self._files['offsets'].write(np.array([self._num_rows], dtype=np.int64).tobytes())
+    self._files['labels'].write(np.asarray(label, dtype=np.int32).tobytes())
+    self._files['gameids'].write(np.array([game_id], dtype=_GAME_ID_DTYPE).tobytes())
+    self.num_samples += 1
+
+  def flush(self):
+    """Makes sure everything appended so far is on disk and visible to
+    readers."""
+    for f in self._files.values():
+      f.flush()
+    self._write_header()
+
+  def close(self):
+    self.flush()
+    for f in self._files.values():
+      f.close()
+
+  def _write_header(self):
+    header = {
+      'num_stats': self.num_stats or 0,
+      'num_games': self.num_samples,
+      'num_rows': self._num_rows,
+    }
+    with atomic_write(SampleStore.header_path(self.prefix)) as f:
+      json.dump(header, f)
@@ -0,0 +1,30 @@
+import heapq
+
+
+class GameScheduler(object):
+  """Merges the event files of a season so their games come out in
+  chronological order.
+
+  Every event file holds the home games of one team, already sorted by date.
+  Each file's EventReader knows the date of its next game without
+  re-tokenizing, so the files are merged with a priority queue keyed on
+  those dates. Picking the next game costs O(log teams) rather than a rescan
+  of every file."""
+
+  def __init__(self, readers):
+    self._readers = readers
+    # entries are (next game date, reader index). Ties on date go to the
+    # lowest reader index.
+    self._queue = [(reader.peek_date(), i) for i, reader in enumerate(readers) if reader.has_next()]
+    heapq.heapify(self._queue)
+
+  def __iter__(self):
+    """Yields the EventReader holding the next game, once per game. The
+    caller must consume exactly that one game (see Game.gobble) before asking
+    for the next."""
+    while self._queue:
+      _, i = heapq.heappop(self._queue)
+      reader = self._readers[i]
+      yield reader
+      if reader.has_next():
+        heapq.heappush(self._queue, (reader.peek_date(), i))
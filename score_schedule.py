@@ -0,0 +1,137 @@
+"""Predicts every game of a schedule, e.g. a whole coming season.
+
+Reads a Retrosheet schedule file (like 2020SKED.TXT, see
+https://www.retrosheet.org/schedule/index.html), or a CSV of date, visiting
+team, home team lines, and writes one line of predictions per game. Player
+stats are those of the parser's latest checkpoint. Each team's roster is
+either everyone who played in its last parsed game (--roster_style=last) or
+its latest roster file (--roster_style=full), e.g. the rosters of the coming
+season given with --roster_path.
+
+  python score_schedule.py --schedule=2020SKED.TXT --parsed_data_prefix=out --data_path=data
+    --winner_model=winner_model.h5 --score_model=score_model.h5 --results_path=2020_predictions.csv
+"""
+from keras.models import load_model
+from matchups import MatchupSampler, ScheduleSamples
+
+import argparse
+from collections import OrderedDict
+import csv
+import os
+import time
+
+import numpy as np
+
+ROSTER_STYLES = ['last', 'full']
+
+
+def read_schedule(filename):
+  """(date, game number, visiting team, home team) of every game."""
+  games = []
+  with open(filename, 'r', newline='') as f:
+    for parts in csv.reader(f):
+      parts = [part.strip() for part in parts]
+      if not parts or not parts[0].isdigit():
+        # blank lines and headers
+        continue
+      if len(parts) >= 7:
+        # Retrosheet: date, game number, day, visitors, their league, their
+        # game number, home team, ...
+        games.append((parts[0], parts[1], parts[3], parts[6]))
+      else:
+        games.append((parts[0], '0', parts[1], parts[2]))
+  return games
+
+
+def team_rosters(sampler, roster_style):
+  """team: player ids of every team."""
+  if roster_style == 'last':
+    return OrderedDict((team, list(player_ids)) for team, player_ids in sampler.last_game_rosters.items() if player_ids)
+  # The latest roster file of every team.
+  rosters = OrderedDict()
+  for year in sorted(sampler.full_rosters.years()):
+    for team in sampler.full_rosters.teams(year):
+      rosters[team] = list(sampler.full_rosters.team(year, team).player_ids)
+  return rosters
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--schedule', action='store', required=True, dest='schedule',
+                      help='Schedule file of the games to predict')
+  parser.add_argument('--parsed_data_prefix', action='store', default='.\\out', dest='parsed_data_prefix',
+                      help='Prefix the data was parsed to. Player stats are read from its checkpoint.')
+  parser.add_argument('--data_path', action='store', default='.\\data\\', dest='data_path',
+                      help='Data dir with the roster files, for players\' handedness')
+  parser.add_argument('--roster_style', action='store', default='last', dest='roster_style', choices=ROSTER_STYLES,
+                      help='Assume each team plays everyone from its last game, or its full latest roster')
+  parser.add_argument('--roster_path', action='store', default=None, dest='roster_path',
+                      help='Season dir or zip of roster files to use on top of those in --data_path, e.g. the coming season\'s')
+  parser.add_argument('--winner_model', action='store', default='winner_model.h5', dest='winner_model',
+                      help='Model from keras_winner.py. Empty to skip.')
+  parser.add_argument('--score_model', action='store', default='', dest='score_model',
+                      help='Model from keras_score.py. Empty to skip.')
+  parser.add_argument('--spread_model', action='store', default='', dest='spread_model',
+                      help='Model from keras_spread.py. Empty to skip.')
+  parser.add_argument('--batch_size', action='store', default=4096, dest='batch_size', type=int,
+                      help='Games per model.predict() call')
+  parser.add_argument('--padded_len', action='store', default=0, dest='padded_len', type=int,
+                      help='Pad games to at least this many players. Only needed for models without a Masking layer, '
+                           'which must get as many players as they were trained on.')
+  parser.add_argument('--results_path', action='store', default='predictions.csv', dest='results_path',
+                      help='Where to write the predictions, as CSV')
+  args = parser.parse_args()
+
+  model_paths = OrderedDict([('winner', args.winner_model), ('score', args.score_model), ('spread', args.spread_model)])
+  model_paths = OrderedDict((name, path) for name, path in model_paths.items() if path)
+  if not model_paths:
+    parser.error('Give at least one model to predict with.')
+  for path in model_paths.values():
+    if not os.path.isfile(path):
+      parser.error('No model at {}'.format(path))
+
+  games = read_schedule(args.schedule)
+  print('{} games on the schedule'.format(len(games)))
+  sampler = MatchupSampler.from_checkpoint(args.parsed_data_prefix, args.data_path, roster_path=args.roster_path)
+  models = OrderedDict((name, load_model(path)) for name, path in model_paths.items())
+
+  start = time.perf_counter()
+  schedule = ScheduleSamples(sampler, team_rosters(sampler, args.roster_style))
+  visitor_teams = [game[2] for game in games]
+  home_teams = [game[3] for game in games]
+  predictions = OrderedDict((name, []) for name in models)
+  sample_seconds = 0.0
+  for batch_start in range(0, len(games), args.batch_size):
+    batch_end = batch_start + args.batch_size
+    sample_start = time.perf_counter()
+    x = schedule.padded(visitor_teams[batch_start:batch_end], home_teams[batch_start:batch_end], args.padded_len)
+    sample_seconds += time.perf_counter() - sample_start
+    for name, model in models.items():
+      predictions[name].append(np.asarray(model.predict(x, batch_size=len(x))).reshape(len(x), -1))
+  predictions = OrderedDict((name, np.concatenate(batches)) for name, batches in predictions.items())
+  seconds = time.perf_counter() - start
+
+  with open(args.results_path, 'w', newline='') as f:
+    writer = csv.writer(f)
+    header = ['date', 'game_number', 'visitor', 'home']
+    if 'winner' in predictions:
+      header.append('home_win_probability')
+    if 'score' in predictions:
+      header.extend(['visitor_score', 'home_score'])
+    if 'spread' in predictions:
+      # visitor score - home score, like the labels keras_spread.py trains on
+      header.append('spread')
+    writer.writerow(header)
+    for i, game in enumerate(games):
+      row = list(game)
+      for name in predictions:
+        row.extend('{:.4f}'.format(value) for value in predictions[name][i])
+      writer.writerow(row)
+
+  print('Predicted {} games in {:.2f}s ({:.0f} games/s, {:.2f}s of it building samples)'.format(
+    len(games), seconds, len(games) / seconds if seconds else 0, sample_seconds))
+  print('Predictions saved to {}'.format(args.results_path))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+import sys
+import time
+
+try:
+  import resource
+except ImportError:
+  # Not available on Windows.
+  resource = None
+
+
+class StageTimers(object):
+  """Wall time spent in each stage of parsing, and counts of things done.
+
+  Stages are timed where they happen (see the module-level stages), which is
+  cheap enough to leave on all the time. Time spent in worker processes isn't
+  included."""
+
+  def __init__(self):
+    self.seconds = OrderedDict()  # stage: total seconds
+    self.counts = OrderedDict()  # counter: total
+
+  def add_time(self, stage, seconds):
+    self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+  def count(self, counter, n=1):
+    self.counts[counter] = self.counts.get(counter, 0) + n
+
+  def reset(self):
+    self.seconds.clear()
+    self.counts.clear()
+
+  def report(self):
+    return OrderedDict([
+      ('seconds', OrderedDict(self.seconds)),
+      ('counts', OrderedDict(self.counts)),
+      ('peak_rss_mb', peak_rss_mb()),
+    ])
+
+
+def peak_rss_mb():
+  """Peak resident memory of this process and its finished children in MB, or
+  None where that can't be measured."""
+  if resource is None:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+  # KB on Linux, bytes on macOS.
+  if sys.platform == 'darwin':
+    return peak / 2**20
+  return peak / 2**10
+
+
+class Progress(object):
+  """Prints the throughput and estimated time left of a season every
+  interval seconds."""
+
+  def __init__(self, name, total_games, interval=10.0):
+    self.name = name
+    self.total_games = total_games
+    self.interval = interval
+    self.start = time.perf_counter()
+    self._last_print = self.start
+
+  def games_per_second(self, games_done):
+    elapsed = time.perf_counter() - self.start
+    return games_done / elapsed if elapsed else 0.0
+
+  def update(self, games_done, force=False):
+    now = time.perf_counter()
+    if not force and now - self._last_print < self.interval:
+      return
+    self._last_print = now
+    rate = self.games_per_second(games_done)
+    eta = (self.total_games - games_done) / rate if rate else float('inf')
+    print('{}: {}/{} games, {:.1f} games/s, {:.0f}s left, peak memory {}'.format(
+      self.name, games_done, self.total_games, rate, eta, format_mb(peak_rss_mb())))
+
+
+def format_mb(mb):
+  return 'unknown' if mb is None else '{:.0f}MB'.format(mb)
+
+
+# Shared by everything in the process, like StatsTracker.play_cache.
+stages = StageTimers()
@@ -0,0 +1,105 @@
+from atomic_write import atomic_write
+from player import Player, NUM_COUNTERS
+
+import glob
+import numpy as np
+import os
+
+
+class StatsHistory(object):
+  """Every player's stats as of any date, as recorded during parsing.
+
+  After each game, the cumulative counters (see player.py) of every player
+  in it are recorded along with the game's date. Dates are the 9 digit
+  YYYYMMDDN of game ids, N being the game number of a double header, so
+  as_of(player_id, 201904040) is a player's stats before any game on April
+  4th, 2019.
+
+  Recorded stats are saved one file per season next to the samples, and
+  load() reads them all back for lookups."""
+
+  def __init__(self):
+    # Recorded since the last save.
+    self._player_ids = []
+    self._dates = []
+    self._counters = []
+    # Set by load().
+    self.player_ids = None
+    self.dates = None
+    self.counters = None
+    self._player_slices = {}  # player id: (start, end) of their rows
+
+  @staticmethod
+  def path(prefix, season):
+    return '{}_history_{}.npz'.format(prefix, season)
+
+  @staticmethod
+  def remove(prefix):
+    """Deletes all saved history under prefix."""
+    for filename in glob.glob(StatsHistory.path(prefix, '*')):
+      os.remove(filename)
+
+  def record(self, date, stats_tracker, player_ids):
+    """Records the current stats of the given players after a game on date."""
+    rows = [stats_tracker.index[player_id] for player_id in player_ids]
+    self._player_ids.extend(player_ids)
+    self._dates.extend([date] * len(rows))
+    self._counters.append(stats_tracker.counters[rows])
+
+  def save(self, prefix, season):
+    """Saves everything recorded since the last save as the given season."""
+    if self._counters:
+      counters = np.concatenate(self._counters)
+    else:
+      counters = np.zeros((0, NUM_COUNTERS), dtype=np.int32)
+    with atomic_write(StatsHistory.path(prefix, season), 'wb') as f:
+      np.savez_compressed(f,
+        player_ids=np.array(self._player_ids, dtype=np.str_),
+        dates=np.array(self._dates, dtype=np.int64),
+        counters=counters)
+    self._player_ids, self._dates, self._counters = [], [], []
+
+  @classmethod
+  def load(cls, prefix):
+    """Reads back every season saved under prefix."""
+    history = cls()
+    seasons = [np.load(filename) for filename in sorted(glob.glob(StatsHistory.path(prefix, '*')))]
+    assert seasons, 'No stats history found at {}'.format(prefix)
+    player_ids = np.concatenate([season['player_ids'] for season in seasons])
+    dates = np.concatenate([season['dates'] for season in seasons])
+    counters = np.concatenate([season['counters'] for season in seasons])
+    # Group each player's rows together, in date order.
+    order = np.lexsort((dates, player_ids))
+    history.player_ids = player_ids[order]
+    history.dates = dates[order]
+    history.counters = counters[order]
+    unique_ids, starts = np.unique(history.player_ids, return_index=True)
+    ends = np.append(starts[1:], len(order))
+    history._player_slices = {player_id: (start, end) for player_id, start, end in zip(unique_ids.tolist(), starts.tolist(), ends.tolist())}
+    return history
+
+  def has_player(self, player_id):
+    return player_id in self._player_slices
+
+  def as_of(self, player_id, date):
+    """A player's counters after all of their games strictly before date.
+    All zeros if there were none."""
+    if player_id not in self._player_slices:
+      return np.zeros(NUM_COUNTERS, dtype=np.int32)
+    start, end = self._player_slices[player_id]
+    games_before = np.searchsorted(self.dates[start:end], date, side='left')
+    if not games_before:
+      return np.zeros(NUM_COUNTERS, dtype=np.int32)
+    return self.counters[start + games_before - 1]
+
+  def as_of_many(self, player_ids, date):
+    """as_of() for a whole roster at once, as a [players, counters] matrix."""
+    counters = np.zeros((len(player_ids), NUM_COUNTERS), dtype=np.int32)
+    for i, player_id in enumerate(player_ids):
+      counters[i] = self.as_of(player_id, date)
+    return counters
+
+  def player(self, player_id, date):
+    """A standalone Player with the player's stats as of date. Use its
+    to_vector() to remake the player's part of a sample."""
+    return Player(player_id, counters=self.as_of(player_id, date).copy())
@@ -1,75 +1,240 @@
 from event import Event
-from play import Play
-from player import Player
+from play import Play, PlayCache
+from stage_timers import stages
+from player import (Player, at_bat_counts, BATTING, PITCHING, FIELDING, NUM_AT_BAT_COUNTERS, NUM_COUNTERS,
+                    FIELDING_PLAYS, FIELDING_OUTS, FIELDING_ERRORS, FIELDING_POINTS)
 
 from collections import OrderedDict
+import numpy as np
+import time
+
+class PlayTally(object):
+  """The parts of a Play that player stats are tallied from, worked out once
+  per distinct play rather than for every play event.
+
+  kind says which players a play involves, see below. counts are the play's
+  at_bat_counts() if it is an at bat, otherwise None. fielders are the field
+  positions credited with the play or an error, in the order they are
+  tallied. points are [away points scored, home points scored]."""
+
+  NO_PLAY = 0  # NP, a place holder
+  PASSED_BALL = 1  # a catcher error
+  # Things that don't automatically involve the pitcher and catcher: caught
+  # stealing, picked off, error on a foul ball, other advance, stolen bases,
+  # defensive indifference, interference.
+  # TODO this could definitely have better attribution.
+  NO_AT_BAT = 2
+  AT_BAT = 3
+  _NO_AT_BAT_RESULTS = frozenset(['CS', 'CSH', 'PO', 'POCS', 'POCSH', 'FLE', 'OA', 'SB', 'SBH', 'DI', 'C'])
+
+  __slots__ = ('kind', 'counts', 'fielders', 'error_positions', 'outs', 'points')
+
+  def __init__(self, kind, counts, fielders, error_positions, outs, points):
+    self.kind = kind
+    self.counts = counts
+    self.fielders = fielders
+    self.error_positions = error_positions
+    self.outs = outs
+    self.points = points
+
+  @classmethod
+  def from_play(cls, play, play_event=None):
+    if play.result == 'NP':
+      return cls(PlayTally.NO_PLAY, None, (), frozenset(), 0, [0, 0])
+    if play.result == 'PB':
+      kind = PlayTally.PASSED_BALL
+    elif play.result in PlayTally._NO_AT_BAT_RESULTS:
+      kind = PlayTally.NO_AT_BAT
+    else:
+      kind = PlayTally.AT_BAT
+    counts = at_bat_counts(play, play_event) if kind == PlayTally.AT_BAT else None
+    return cls(kind, counts, tuple(play.fielders_involved | play.error_positions), frozenset(play.error_positions),
+               play.outs, list(play.points))
+
+  @classmethod
+  def from_event(cls, play_event):
+    return cls.from_play(Play.from_event(play_event), play_event)
+
+  @staticmethod
+  def to_columns(tallies):
+    """Tallies as a few flat arrays, which are much smaller and quicker to
+    pickle than the tallies themselves. See from_columns()."""
+    counts = np.zeros((len(tallies), NUM_AT_BAT_COUNTERS), dtype=np.int32)
+    fielders, errors = [], []
+    fielder_ends = np.zeros(len(tallies), dtype=np.int32)
+    error_ends = np.zeros(len(tallies), dtype=np.int32)
+    for i, tally in enumerate(tallies):
+      if tally.counts is not None:
+        counts[i] = tally.counts
+      fielders.extend(tally.fielders)
+      fielder_ends[i] = len(fielders)
+      errors.extend(sorted(tally.error_positions))
+      error_ends[i] = len(errors)
+    return {
+      'kinds': np.array([tally.kind for tally in tallies], dtype=np.int8),
+      'counts': counts,
+      'fielders': np.array(fielders, dtype=np.int8),
+      'fielder_ends': fielder_ends,
+      'errors': np.array(errors, dtype=np.int8),
+      'error_ends': error_ends,
+      'outs': np.array([tally.outs for tally in tallies], dtype=np.int32),
+      'points': np.array([tally.points for tally in tallies], dtype=np.int32).reshape(-1, 2),
+    }
+
+  @classmethod
+  def from_columns(cls, columns):
+    """The tallies given to to_columns()."""
+    tallies = []
+    fielders = columns['fielders'].tolist()
+    errors = columns['errors'].tolist()
+    fielder_start = error_start = 0
+    for i, (kind, outs, points, fielder_end, error_end) in enumerate(zip(
+        columns['kinds'].tolist(), columns['outs'].tolist(), columns['points'].tolist(),
+        columns['fielder_ends'].tolist(), columns['error_ends'].tolist())):
+      counts = columns['counts'][i] if kind == PlayTally.AT_BAT else None
+      tallies.append(cls(kind, counts, tuple(fielders[fielder_start:fielder_end]),
+                         frozenset(errors[error_start:error_end]), outs, points))
+      fielder_start, error_start = fielder_end, error_end
+    return tallies
+
 
 class StatsTracker(object):
   """Calculates all players' statistics by reading every play in the dataset.
   A given play may involve updates to the stats of the pitcher, the batter, and
   multiple fielders.
+
+  Every player gets a row of raw counters in one int32 matrix (see player.py
+  for the column layout), so merging trackers is a single row-wise add.
   """
+
+  # Tallies of decoded plays are shared by all trackers, since a new tracker
+  # is made for every game.
+  play_cache = PlayCache(decode=PlayTally.from_event)
   
+  # float_precision: vector of a player with no stats
+  _empty_vectors = {}
+
   def __init__(self):
-    self.players = OrderedDict()
-    
+    self.index = OrderedDict()  # player id: row in counters
+    self.counters = np.zeros((64, NUM_COUNTERS), dtype=np.int32)
+    self._positions = {}  # row: current fielding position
+    # float_precision: row: player vector, for players whose stats haven't
+    # changed since their vector was made
+    self._vectors = {True: {}, False: {}}
+
+  def __getstate__(self):
+    # Don't save the unused rows, or vectors that are cheap to remake.
+    state = dict(self.__dict__)
+    state['counters'] = self.counters[:len(self.index)]
+    state['_vectors'] = {True: {}, False: {}}
+    return state
+
   def get_player(self, player_id):
-    return self.players[player_id]
-    
+    if player_id not in self.index:
+      raise KeyError(player_id)
+    return Player(player_id, tracker=self)
+
   def get_players(self):
-    return self.players
-    
-  def has_player(self, player_id):
-    return player_id in self.players
+    return OrderedDict((player_id, Player(player_id, tracker=self)) for player_id in self.index)
+
+  def player_vector(self, player_id, float_precision):
+    """Player.to_vector() of a player, as a numpy array. Players the tracker
+    hasn't seen get the vector of a player with no stats.
     
-  def _getOrCreate(self, player_id):
-    if player_id not in self.players:
-      self.players[player_id] = Player(player_id)
-    return self.players[player_id]
+    Vectors are cached until the player's stats next change, so this must not
+    be modified."""
+    row = self.index.get(player_id)
+    if row is None:
+      vector = StatsTracker._empty_vectors.get(float_precision)
+      if vector is None:
+        vector = np.array(Player(player_id).to_vector(float_precision=float_precision))
+        StatsTracker._empty_vectors[float_precision] = vector
+      return vector
+    vectors = self._vectors[float_precision]
+    vector = vectors.get(row)
+    if vector is None:
+      vector = np.array(Player(player_id, tracker=self).to_vector(float_precision=float_precision))
+      vectors[row] = vector
+    return vector
     
+  def has_player(self, player_id):
+    return player_id in self.index
+
+  def _row(self, player_id):
+    # Row of a player's counters, adding one if needed.
+    row = self.index.get(player_id)
+    if row is None:
+      row = len(self.index)
+      if row == len(self.counters):
+        grown = np.zeros((max(2 * row, 64), NUM_COUNTERS), dtype=np.int32)
+        grown[:row] = self.counters
+        self.counters = grown
+      self.index[player_id] = row
+    return row
+
+  def _fielding_row(self, player_id):
+    # Row of a player's counters, and the position they are fielding.
+    row = self._row(player_id)
+    position = self._positions.get(row, -1)
+    assert position > 0, player_id
+    return row, position
+
   def set_player_position(self, player_id, position):
-    self._getOrCreate(player_id).fielding.set_position(position)
-  
+    self._positions[self._row(player_id)] = position
+
   def unassign_player(self, player_id, old_position):
     # the old player needs to be unassigned IF they aren't already
     # in another position.
-    self.players[player_id].fielding.unassign_position(old_position)
-    
+    row = self.index[player_id]
+    if self._positions.get(row, -1) == old_position:
+      self._positions[row] = -2
+
+  def _fielded(self, player_id, tally):
+    row, position = self._fielding_row(player_id)
+    counters = self.counters[row, FIELDING + position - 1:]
+    counters[FIELDING_PLAYS] += 1
+    counters[FIELDING_OUTS] += tally.outs
+    counters[FIELDING_POINTS] += sum(tally.points)
+    if position in tally.error_positions:
+      counters[FIELDING_ERRORS] += 1
+
   def play(self, play_event, batter_id, fielder_ids):
-    """Updates all players involved in a play.
+    """Updates all players involved in a play, and returns the points it
+    scored as [away, home].
     fielder_ids is a map telling who is playing each field position."""
-    new_play = Play.from_event(play_event)
-    
+    tally = play_event.tally
+    if tally is None:
+      start = time.perf_counter()
+      tally = StatsTracker.play_cache.from_event(play_event)
+      stages.add_time('decode', time.perf_counter() - start)
+    stages.count('plays')
+
     pitcher_id = fielder_ids[1]
     catcher_id = fielder_ids[2]
-    if new_play.result == 'NP':
-      # NP = No play, a place holder
-      return [0, 0]
-    if new_play.result == 'PB':
-      # PB = passed ball, a catcher error
-      self._getOrCreate(catcher_id).fielding.participated()
-      self._getOrCreate(catcher_id).fielding.error()
-    elif new_play.result in ['CS', 'CSH', 'PO', 'POCS', 'POCSH', 'FLE', 'OA', 'SB', 'SBH', 'DI', 'C']:
-      # Things that don't automatically involve the pitcher and catcher.
-      # caught stealing, picked off, error on a foul ball, other advance, stolen bases, defensive indifference, interference
-      # TODO this could definitely have better attribution.
-      pass
-    else:
-      self._getOrCreate(pitcher_id).pitching.update(new_play)
-      self._getOrCreate(batter_id).batting.update(new_play)
-    
-    for fielder_position in new_play.fielders_involved | new_play.error_positions:
+    if tally.kind == PlayTally.NO_PLAY:
+      return tally.points
+    if tally.kind == PlayTally.PASSED_BALL:
+      row, position = self._fielding_row(catcher_id)
+      self.counters[row, FIELDING + FIELDING_PLAYS + position - 1] += 1
+      self.counters[row, FIELDING + FIELDING_ERRORS + position - 1] += 1
+    elif tally.kind == PlayTally.AT_BAT:
+      self.counters[self._row(pitcher_id), PITCHING:PITCHING + NUM_AT_BAT_COUNTERS] += tally.counts
+      self.counters[self._row(batter_id), BATTING:BATTING + NUM_AT_BAT_COUNTERS] += tally.counts
+
+    for fielder_position in tally.fielders:
       if fielder_position:
-        fielder_id = fielder_ids[fielder_position]
-        self._getOrCreate(fielder_id).fielding.update(new_play)
+        self._fielded(fielder_ids[fielder_position], tally)
       else:
-        print('Warning: saw a play with an invalid fielder ({}): {}'.format(fielder_position, play_event.raw))
-    
-    return new_play.points
-    
+        # Events that were decoded ahead of time don't keep their raw line.
+        print('Warning: saw a play with an invalid fielder ({}): {}'.format(
+          fielder_position, play_event.raw if play_event.raw is not None else ','.join(play_event.parts)))
+
+    return tally.points
+
   def append(self, o):
-    for player_id in o.get_players():
-      if self.has_player(player_id):
-        self.get_player(player_id).append(o.get_player(player_id))
-      else:
-        self.players[player_id] = o.get_player(player_id)
\ No newline at end of file
+    rows = np.array([self._row(player_id) for player_id in o.index], dtype=np.intp)
+    self.counters[rows] += o.counters[:len(rows)]
+    # Those players' vectors are out of date now.
+    for vectors in self._vectors.values():
+      for row in rows.tolist():
+        vectors.pop(row, None)
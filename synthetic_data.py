@@ -0,0 +1,120 @@
+"""Writes made-up, but valid, Retrosheet event and roster files.
+
+Useful for benchmarking and trying out the parser without downloading real
+data. The output is laid out like real data, one directory per season:
+
+  <out_path>/2000ev/2000T00.EVN
+  <out_path>/2000ev/T002000.ROS
+  ...
+
+The same arguments always produce the same files.
+"""
+import argparse
+import os
+import random
+
+# Plays that the parser understands. Most of them move no runners.
+PLAYS = ['K', '63/G', 'S8/G.1-2', 'W', 'HR/F7.2-H;1-H', 'D7/L.1-3', 'NP', 'E6/G.B-1', 'SB2', 'CS2(26)',
+         'FC5/G5.3XH(52)', 'PO1(13)', '43/G.2-3', 'WP.1-2', '8/F', 'K23', 'IW', 'HP', 'T9/L.1-H', 'S7/L#', 'PB.2-3']
+# Plays with several runners advancing, which are the most work to decode.
+ADVANCE_PLAYS = ['S8/G.3-H;2-H;1-3', 'D9/L.2-H;1-H', 'HR/F8.3-H;2-H;1-H', 'S7/G.2-H(E7);1-3', 'E5/G.2-3;1-2;B-1',
+                 'WP.3-H;2-3;1-2', 'S9/L.2-H;1-3;B-2', 'DGR/L9.2-H;1-3', 'BK.3-H;1-2', 'FC6/G.2-3;1XH(62)']
+PITCHES = ['BCFX', 'CX', 'BBBB', 'SSS', 'X', '', 'BFBX', 'C1BX', 'BBCFFBX', '*B1>C.FX']
+
+PLAYERS_PER_TEAM = 25
+# 9 fielders and a designated hitter.
+STARTERS_PER_TEAM = 10
+
+
+def team_ids(num_teams):
+  return ['T{:02d}'.format(i) for i in range(num_teams)]
+
+
+def write_season(season_path, year, teams, games_per_team, rnd, sub_rate=0.3, advance_rate=0.2):
+  """Writes one season's roster and event files under season_path.
+
+  Every team plays about games_per_team games. After each half inning, a
+  team makes a substitution with probability sub_rate, and advance_rate is
+  the fraction of plays drawn from ADVANCE_PLAYS. Returns the number of
+  games written."""
+  os.makedirs(season_path, exist_ok=True)
+  players = {team: ['{}{}{:03d}'.format(team.lower(), year % 10, i) for i in range(PLAYERS_PER_TEAM)] for team in teams}
+  for team in teams:
+    with open(os.path.join(season_path, '{}{}.ROS'.format(team, year)), 'w') as f:
+      for player_id in players[team]:
+        f.write('{},Last,First,{},{},{},X\n'.format(player_id, rnd.choice('LRB'), rnd.choice('LR'), team))
+
+  # Every day, teams are paired up at random. Each game goes in the home
+  # team's event file.
+  lines = {team: [] for team in teams}
+  teams = list(teams)
+  num_games = 0
+  for day in range(games_per_team):
+    month, day_of_month = 4 + day // 28, 1 + day % 28
+    rnd.shuffle(teams)
+    for i in range(0, len(teams) - 1, 2):
+      visitor, home = teams[i], teams[i + 1]
+      game_lines = lines[home]
+      game_lines.append('id,{}{}{:02d}{:02d}0'.format(home, year, month, day_of_month))
+      game_lines.append('version,2')
+      game_lines.append('info,visteam,{}'.format(visitor))
+      game_lines.append('info,hometeam,{}'.format(home))
+      game_lines.append('info,date,{}/{:02d}/{:02d}'.format(year, month, day_of_month))
+      bench = {}
+      for side, team in enumerate([visitor, home]):
+        lineup = rnd.sample(players[team], PLAYERS_PER_TEAM)
+        bench[side] = lineup[STARTERS_PER_TEAM:]
+        for position in range(1, STARTERS_PER_TEAM + 1):
+          player_id = lineup[position - 1]
+          game_lines.append('start,{},"P {}",{},{},{}'.format(player_id, player_id, side, position % 10, position))
+      for inning in range(1, 10):
+        for side, team in enumerate([visitor, home]):
+          for _ in range(rnd.randint(3, 6)):
+            play = rnd.choice(ADVANCE_PLAYS if rnd.random() < advance_rate else PLAYS)
+            game_lines.append('play,{},{},{},12,{},{}'.format(inning, side, rnd.choice(players[team]), rnd.choice(PITCHES), play))
+          if rnd.random() < sub_rate and bench[side]:
+            game_lines.append('sub,{},"Sub Guy",{},0,{}'.format(bench[side].pop(), side, rnd.randint(1, 9)))
+      game_lines.append('data,er,{},1'.format(players[home][0]))
+      num_games += 1
+
+  for team in sorted(lines):
+    with open(os.path.join(season_path, '{}{}.EVN'.format(year, team)), 'w') as f:
+      f.write('\n'.join(lines[team]) + '\n')
+  return num_games
+
+
+def generate(out_path, seasons=3, num_teams=8, games_per_team=60, first_season=2000, sub_rate=0.3, advance_rate=0.2, seed=0):
+  """Writes seasons of data under out_path. Returns the number of games
+  written."""
+  rnd = random.Random(seed)
+  teams = team_ids(num_teams)
+  num_games = 0
+  for year in range(first_season, first_season + seasons):
+    season_path = os.path.join(out_path, '{}ev'.format(year))
+    num_games += write_season(season_path, year, teams, games_per_team, rnd, sub_rate=sub_rate, advance_rate=advance_rate)
+  return num_games
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--out_path', action='store', default='synthetic_data', dest='out_path',
+                      help='Dir to write seasons of event and roster files to')
+  parser.add_argument('--seasons', action='store', default=3, dest='seasons', type=int,
+                      help='Number of seasons')
+  parser.add_argument('--first_season', action='store', default=2000, dest='first_season', type=int,
+                      help='Year of the first season')
+  parser.add_argument('--teams', action='store', default=8, dest='num_teams', type=int,
+                      help='Number of teams')
+  parser.add_argument('--games', action='store', default=60, dest='games_per_team', type=int,
+                      help='Games each team plays per season')
+  parser.add_argument('--sub_rate', action='store', default=0.3, dest='sub_rate', type=float,
+                      help='Chance of a substitution after each half inning')
+  parser.add_argument('--advance_rate', action='store', default=0.2, dest='advance_rate', type=float,
+                      help='Fraction of plays with several runners advancing')
+  parser.add_argument('--seed', action='store', default=0, dest='seed', type=int,
+                      help='Random seed')
+  args = parser.parse_args()
+
+  num_games = generate(args.out_path, seasons=args.seasons, num_teams=args.num_teams, games_per_team=args.games_per_team,
+                       first_season=args.first_season, sub_rate=args.sub_rate, advance_rate=args.advance_rate, seed=args.seed)
+  print('Wrote {} games to {}'.format(num_games, args.out_path))
@@ -1,4 +1,6 @@
-from keras.callbacks.callbacks import Callback
+from keras.utils import Sequence
+from sample_store import SampleStore
+
 import numpy as np
 
 import argparse
@@ -9,7 +11,7 @@ def TrainingArgs():
   parser = argparse.ArgumentParser()
 
   parser.add_argument('--parsed_data_prefix', action='store', default='.\\out', dest='parsed_data_prefix',
-                      help='Path prefix for training data pickles')
+                      help='Path prefix for the training sample store')
   parser.add_argument('--model_path', action='store',
                       default='winner_model.h5', dest='model_path',
                       help='Output path for the saved model')
@@ -28,9 +30,18 @@ def TrainingArgs():
   parser.add_argument('--rnn_layer_size', action='store',
                       default=128, dest='rnn_layer_size',
                       help='Training patience', type=int)
+  parser.add_argument('--stream', action='store_true',
+                      default=False, dest='stream',
+                      help='Stream batches from disk instead of loading all training data into RAM.')
+  parser.add_argument('--bucket', action='store_true',
+                      default=False, dest='bucket',
+                      help='Batch games with similar numbers of players together, padding each batch only as needed. Implies --stream.')
+  parser.add_argument('--workers', action='store',
+                      default=1, dest='workers',
+                      help='Processes preparing batches in parallel when streaming.', type=int)
   parser.add_argument('--roster_shuffle', action='store_true',
                       default=False, dest='roster_shuffle',
-                      help='Shuffle player order on rosters each epoch.')
+                      help='Shuffle the order of players in each game, anew for every game of every batch.')
   parser.add_argument('--validate_fraction', action='store',
                       default=0.04, dest='validate_fraction',
                       help='holdout validate data fraction', type=float)
@@ -46,40 +57,31 @@ def TrainingArgs():
                       
   return parser.parse_args()
 
-def ShufflePlayers(samples):
-  # Shuffle the order of players within each game. This prevents the model from
-  # unfairly knowing who will start the game vs who will be substituted later.
-  rng = np.random.default_rng()
-  rng.shuffle(samples, axis=1)
-  
-def FindCenter(sample):
-  for i, player in enumerate(sample):
-    if player[-1]:
-      return i
-    #print('Found no home team players?')
-    return 0
+def ShufflePlayers(samples, rng=None):
+  # Shuffle the order of players within each game of a [games, players, stats]
+  # batch, in place. This prevents the model from unfairly knowing who will
+  # start the game vs who will be substituted later. Every game gets its own
+  # order, and each team's players stay on their side of the padding.
+  if rng is None:
+    rng = np.random.default_rng()
+  # Sort each game's rows by their side (visitors, padding, home), then by a
+  # random key. Padding rows are all zeros.
+  is_padding = ~np.any(samples, axis=2)
+  is_home = samples[:, :, -1] != 0
+  keys = np.where(is_home, 2, np.where(is_padding, 1, 0)) + rng.random(samples.shape[:2])
+  order = np.argsort(keys, axis=1)
+  samples[:] = np.take_along_axis(samples, order[:, :, np.newaxis], axis=1)
   
-def LoadData(parsed_data_prefix, validate_fraction=0.1, test_fraction=0.1, drop_fraction=0, test_drop_fraction=0):
-  #Reads samples & labels from disk, pads them, and does training/test split.
+def ReadPickledSamples(parsed_data_prefix):
+  # Reads samples & labels from the per-chunk pickles written by older
+  # versions of parse.py, in the same ragged form as a SampleStore.
+  chunk_number = lambda filename: int(filename.rsplit('_', 1)[1].split('.')[0])
   samples = []
   labels = []
-  for filename in glob.glob(parsed_data_prefix + '_samples*.*'):
+  for filename in sorted(glob.glob(parsed_data_prefix + '_samples_*.p'), key=chunk_number):
     samples.extend(pickle.load(open(filename, 'rb')))
-  for filename in glob.glob(parsed_data_prefix + '_labels*.*'):
+  for filename in sorted(glob.glob(parsed_data_prefix + '_labels_*.p'), key=chunk_number):
     labels.extend(pickle.load(open(filename, 'rb')))
-  print('Read {} games'.format(len(samples)))
-  max_num_players = max([len(s) for s in samples])
-  
-  nonempty_mask = [bool(sample[-1][-1]) for sample in samples]
-  print('Dumping {} empty samples'.format(len(nonempty_mask)-sum(nonempty_mask)))
-  samples = [b for a, b in zip(nonempty_mask, samples) if a]
-  labels = [b for a, b in zip(nonempty_mask, labels) if a]
-  
-  # Drops the first few samples, on the theory that you may want to
-  # train on just later samples when there is more player data.
-  # Especially if you are memory-bound.
-  samples = samples[int(len(samples)*drop_fraction):]
-  labels = labels[int(len(labels)*drop_fraction):]
   
   # detect invalid entries
   valid_mask = [type(sample) == type([]) for sample in samples]
@@ -87,59 +89,252 @@ def LoadData(parsed_data_prefix, validate_fraction=0.1, test_fraction=0.1, drop_
     print('WARNING: Dumping {} invalid samples.'.format(len(valid_mask)-sum(valid_mask)))
     samples = [b for a, b in zip(valid_mask, samples) if a]
     labels = [b for a, b in zip(valid_mask, labels) if a]
+    
+  offsets = np.cumsum([0] + [len(sample) for sample in samples])
+  players = np.asarray([player for sample in samples for player in sample], dtype=np.float32)
+  return players, offsets, np.array(labels)
+  
+def ReadSamples(parsed_data_prefix):
+  # Returns (players, offsets, labels). Game i's players are rows
+  # offsets[i]:offsets[i+1] of the players matrix. With a sample store these
+  # are memory-mapped, so nothing is read yet.
+  if not SampleStore.exists(parsed_data_prefix):
+    return ReadPickledSamples(parsed_data_prefix)
+  store = SampleStore(parsed_data_prefix)
+  return store.players, store.offsets, store.labels
+  
+def PadGames(players, starts, ends, padded_len, out=None, block_size=10000):
+  """Gathers games out of a ragged players matrix into one
+  [games, padded_len, stats] array. Game i is rows starts[i]:ends[i].
   
-  # Pad all game samples to the same length
-  player_len = 0
-  for sample in samples:
-    if sample:
-      player_len = max(player_len, len(sample[0]))
-  print('Players have {} stats each'.format(player_len))
-  assert player_len
-  
-  for game in samples:
-    # perhaps it's best to pad the center so the teams are separated by
-    # the pad in the center.
-    center = FindCenter(game)
-    while len(game) < max_num_players * 1.05:
-      game.insert(center, [0]*player_len)
-  labels = np.array(labels)
-  samples = np.asarray(samples)
+  Each game is padded in its center, so the visiting team's players (the
+  leading rows, whose last stat is 0) sit at the start and the home team's
+  players at the end, separated by the padding. The output is allocated once
+  (or given as out) and filled block by block, with no per-game Python work.
+  """
+  starts = np.asarray(starts, dtype=np.int64)
+  ends = np.asarray(ends, dtype=np.int64)
+  if out is None:
+    out = np.zeros((len(starts), padded_len, players.shape[1]), dtype=np.float32)
+  for block_start in range(0, len(starts), block_size):
+    block_starts = starts[block_start:block_start+block_size]
+    lengths = ends[block_start:block_start+block_size] - block_starts
+    assert np.all(lengths <= padded_len), 'A game has more than {} players'.format(padded_len)
+    # For every row we copy: which game it belongs to, its source row, and its
+    # position within its game.
+    game_of_row = np.repeat(np.arange(len(lengths)), lengths)
+    row_starts = np.cumsum(lengths) - lengths
+    position = np.arange(lengths.sum()) - np.repeat(row_starts, lengths)
+    rows = players[np.repeat(block_starts, lengths) + position]
+    # Home players move to the end of the padded game.
+    is_home = rows[:, -1] != 0
+    position[is_home] += np.repeat(padded_len - lengths, lengths)[is_home]
+    out[block_start + game_of_row, position] = rows
+  return out
+  
+def SplitGames(players, offsets, validate_fraction, test_fraction, drop_fraction, test_drop_fraction):
+  # Picks out the usable games and splits them into training, validation and
+  # test games. Returns the length all games should be padded to, and game
+  # index arrays for (train, validate, test).
+  starts, ends = offsets[:-1], offsets[1:]
+  print('Read {} games'.format(len(starts)))
+  max_num_players = int(np.max(ends - starts))
+  
+  # A game's last player should be on the home team.
+  nonempty_mask = (ends > starts) & (players[np.maximum(ends-1, 0), -1] != 0)
+  print('Dumping {} empty samples'.format(len(nonempty_mask)-np.sum(nonempty_mask)))
+  games = np.flatnonzero(nonempty_mask)
+  
+  # Drops the first few samples, on the theory that you may want to
+  # train on just later samples when there is more player data.
+  # Especially if you are memory-bound.
+  games = games[int(len(games)*drop_fraction):]
   
   # Hold back some data for testing. It's probably import that the game
   # order has NOT been shuffled at this point, so that the test samples
   # come from chronologically later games than training. It may not be
   # fair to let the model train on player stats that were influenced by
   # the test games.
-  samples_train, samples_test, samples_validate = np.split(
-    samples, [int((1-test_fraction-validate_fraction) * len(samples)), int((1-validate_fraction) * len(samples))])
-  labels_train, labels_test, labels_validate = np.split(
-    labels, [int((1-test_fraction-validate_fraction) * len(labels)), int((1-validate_fraction) * len(labels))])
-    
-  assert len(samples_train) + len(samples_validate) + len(samples_test) == len(samples)
+  games_train, games_test, games_validate = np.split(
+    games, [int((1-test_fraction-validate_fraction) * len(games)), int((1-validate_fraction) * len(games))])
+  games_test = games_test[int(len(games_test)*test_drop_fraction):]
+  
+  print('Players have {} stats each'.format(players.shape[1]))
+  assert players.shape[1]
+  print('{} train, {} validate, {} test samples.'.format(len(games_train), len(games_validate), len(games_test)))
+  
+  # perhaps it's best to pad the center so the teams are separated by
+  # the pad in the center.
+  padded_len = int(np.ceil(max_num_players * 1.05))
+  return padded_len, games_train, games_validate, games_test
   
-  samples_test = samples_test[int(len(samples_test)*test_drop_fraction):]
-  labels_test = labels_test[int(len(labels_test)*test_drop_fraction):]
+def LoadData(parsed_data_prefix, validate_fraction=0.1, test_fraction=0.1, drop_fraction=0, test_drop_fraction=0):
+  #Reads samples & labels from disk, pads them, and does training/test split.
+  players, offsets, labels = ReadSamples(parsed_data_prefix)
+  padded_len, games_train, games_validate, games_test = SplitGames(
+    players, offsets, validate_fraction, test_fraction, drop_fraction, test_drop_fraction)
+  
+  # Pad all game samples to the same length, in one array.
+  games = np.concatenate([games_train, games_validate, games_test])
+  samples = PadGames(players, offsets[games], offsets[games+1], padded_len)
+  labels = np.asarray(labels[games])
+  
+  # These are views of the one padded array, not copies. The splits don't
+  # overlap, so editing one (say, shuffling it) doesn't touch the others.
+  split_points = [len(games_train), len(games_train) + len(games_validate)]
+  samples_train, samples_validate, samples_test = np.split(samples, split_points)
+  labels_train, labels_validate, labels_test = np.split(labels, split_points)
   
-  print('{} train, {} validate, {} test samples.'.format(len(samples_train), len(samples_validate), len(samples_test)))
   print('Home team won {:.1f}% of training games and {:.1f}% of test games. Your model better beat this.'.format(
     HomeTeamWinRate(labels_train)*100,
     HomeTeamWinRate(labels_test)*100))
     
-  # Convert these views to copies, so that no cross-edits happen
-  return (np.copy(samples_train), np.copy(samples_validate), np.copy(samples_test),
-          np.copy(labels_train),  np.copy(labels_validate),  np.copy(labels_test))
+  return (samples_train, samples_validate, samples_test,
+          labels_train,  labels_validate,  labels_test)
           
+class GameSequence(Sequence):
+  """Feeds padded batches of games from a sample store to Keras' fit(),
+  evaluate() and predict(), so the padded dataset never has to fit in RAM.
+  
+  Only one batch is read and padded at a time. The store is memory-mapped
+  separately in every process that uses the sequence, so Keras workers can
+  prepare batches in parallel (see fit()'s workers argument).
+  
+  With bucket set, games with similar numbers of players are batched
+  together, and each batch is only padded to its longest game. Models should
+  then start with a Masking layer and accept any number of players."""
+  
+  def __init__(self, parsed_data_prefix, games, labels, padded_len, batch_size, shuffle=False, roster_shuffle=False, bucket=False):
+    """games are indices into the store, and labels are the training labels
+    of those games."""
+    self.parsed_data_prefix = parsed_data_prefix
+    self.games = games
+    self.labels = labels
+    self.padded_len = padded_len
+    self.batch_size = batch_size
+    # Shuffle the order of games each epoch.
+    self.shuffle = shuffle
+    # Shuffle the order of players in each game, as batches are read.
+    self.roster_shuffle = roster_shuffle
+    self.bucket = bucket
+    self._store = None
+    self._num_players = self._get_store().num_players()[games]
+    self._make_batches()
+    
+  def __getstate__(self):
+    # Worker processes map the store themselves, rather than getting a copy
+    # of it.
+    state = dict(self.__dict__)
+    state['_store'] = None
+    return state
+    
+  def _get_store(self):
+    if self._store is None:
+      self._store = SampleStore(self.parsed_data_prefix)
+    return self._store
+    
+  def num_stats(self):
+    return self._get_store().num_stats
+    
+  def _pad(self, games, padded_len):
+    store = self._get_store()
+    return PadGames(store.players, store.offsets[games], store.offsets[games+1], padded_len)
+    
+  def _make_batches(self):
+    # Splits the games into batches, as positions in self.games.
+    if self.bucket:
+      # Sort by number of players. When shuffling, ties are broken randomly.
+      tie_breaker = np.random.random(len(self.games)) if self.shuffle else np.arange(len(self.games))
+      order = np.lexsort((tie_breaker, self._num_players))
+    elif self.shuffle:
+      order = np.random.permutation(len(self.games))
+    else:
+      order = np.arange(len(self.games))
+    self._batches = [order[i:i+self.batch_size] for i in range(0, len(order), self.batch_size)]
+    if self.bucket and self.shuffle:
+      self._batches = [self._batches[i] for i in np.random.permutation(len(self._batches))]
+    
+  def __len__(self):
+    return len(self._batches)
+    
+  def __getitem__(self, idx):
+    batch = self._batches[idx]
+    padded_len = self.padded_len
+    if self.bucket:
+      padded_len = int(np.max(self._num_players[batch]))
+    samples = self._pad(self.games[batch], padded_len)
+    if self.roster_shuffle:
+      ShufflePlayers(samples)
+    return samples, self.labels[batch]
+    
+  def on_epoch_end(self):
+    if self.shuffle:
+      self._make_batches()
+      
+  def all(self):
+    """Every game of the sequence at once, in game order, as (samples, labels).
+    Handy for small sets like the test set."""
+    return self._pad(self.games, self.padded_len), self.labels
+    
+def LoadSequences(parsed_data_prefix, batch_size, label_fn=None, roster_shuffle=False, bucket=False, validate_fraction=0.1, test_fraction=0.1, drop_fraction=0, test_drop_fraction=0):
+  """The streaming version of LoadData. Does the same training/test split, but
+  returns a GameSequence for each of (train, validate, test).
+  
+  label_fn turns an array of [visitor score, home score] labels into whatever
+  the model is trained on. By default, models are trained on the scores.
+  See GameSequence for bucket."""
+  if label_fn is None:
+    label_fn = lambda points: points
+  assert SampleStore.exists(parsed_data_prefix), (
+    'Streaming needs a sample store at {}. Please re-run parse.py.'.format(parsed_data_prefix))
+  store = SampleStore(parsed_data_prefix)
+  padded_len, games_train, games_validate, games_test = SplitGames(
+    store.players, store.offsets, validate_fraction, test_fraction, drop_fraction, test_drop_fraction)
+  print('Home team won {:.1f}% of training games and {:.1f}% of test games. Your model better beat this.'.format(
+    HomeTeamWinRate(store.labels[games_train])*100,
+    HomeTeamWinRate(store.labels[games_test])*100))
+  return (
+    GameSequence(parsed_data_prefix, games_train, label_fn(np.asarray(store.labels[games_train])), padded_len, batch_size,
+                 shuffle=True, roster_shuffle=roster_shuffle, bucket=bucket),
+    GameSequence(parsed_data_prefix, games_validate, label_fn(np.asarray(store.labels[games_validate])), padded_len, batch_size,
+                 bucket=bucket),
+    GameSequence(parsed_data_prefix, games_test, label_fn(np.asarray(store.labels[games_test])), padded_len, batch_size,
+                 bucket=bucket))
+    
 def HomeTeamWinRate(labels):
   winners = [label[1] > label[0] for label in labels]
   return sum(winners)/len(winners)
   
-class ShuffleCallback(Callback): 
-  """Shuffling the order of players denies the model unfair knowledge about who
-  is starting, so it initially performs way worse. But if we shuffle at each
-  epoch then it acts like data augmentation, allowing us to train MUCH longer
-  before overfitting."""
-  def __init__(self, samples):
+class ArraySequence(Sequence):
+  """Feeds batches of games already in RAM to Keras' fit(), like
+  GameSequence does from disk.
+  
+  With roster_shuffle set, players are shuffled batch by batch as the
+  batches are handed out, in Keras' background workers (see fit()'s workers
+  argument), rather than over the whole training set between epochs."""
+  
+  def __init__(self, samples, labels, batch_size, shuffle=True, roster_shuffle=False):
     self.samples = samples
+    self.labels = labels
+    self.batch_size = batch_size
+    # Shuffle the order of games each epoch.
+    self.shuffle = shuffle
+    # Shuffle the order of players in each game.
+    self.roster_shuffle = roster_shuffle
+    self._order = np.arange(len(samples))
+    self.on_epoch_end()
+    
+  def __len__(self):
+    return (len(self.samples) + self.batch_size - 1) // self.batch_size
+    
+  def __getitem__(self, idx):
+    batch = np.sort(self._order[idx*self.batch_size:(idx+1)*self.batch_size])
+    # Fancy indexing copies, so the training set itself is never touched.
+    samples = self.samples[batch]
+    if self.roster_shuffle:
+      ShufflePlayers(samples)
+    return samples, self.labels[batch]
     
-  def on_epoch_begin(self, epoch, logs={}):
-    ShufflePlayers(self.samples)
\ No newline at end of file
+  def on_epoch_end(self):
+    if self.shuffle:
+      np.random.shuffle(self._order)